@@ -1,6 +1,9 @@
 import asyncio
 import json
+import threading
+from contextlib import nullcontext
 
+import journal
 import utils
 import zcash
 
@@ -11,8 +14,9 @@ from rich.markdown import Markdown
 from rich import print as rprint
 
 from intents.deposit import _deposit_to_intents
-from intents.swap import intent_swap
+from intents.swap import intent_swap, preview_intent_swap, quote_intent_swap_tiers
 from intents.withdraw import withdraw_from_intents
+from token_registry import registry, token_cache
 from io import StringIO
 
 import sys
@@ -148,8 +152,14 @@ except TypeError:
 
 console = Console()
 
-with open("tokens.json", "r") as file:
-    data = json.load(file)
+def status(message):
+    """Console spinner for a long step; none off the main thread (background
+    jobs), since rich allows only one live display per console."""
+    if threading.current_thread() is not threading.main_thread():
+        return nullcontext()
+    return console.status(message)
+
+data = registry
 
 with open("env", "r") as file:
     env_vars = json.load(file)
@@ -170,13 +180,9 @@ with open("env", "r") as file:
 
 # env:Environment
 
-with open("tokens.json", "r") as file:
-    data = json.load(file)
-
 def get_all_tokens():
     """Gets all the tokens supported with relevant metadata. Use this tool to get the tokens supported. This tool is not intended for direct calls by users."""
-    data = utils.load_url("https://api-mng-console.chaindefuser.com/api/tokens")
-    return data["items"]
+    return [dict(token) for token in token_cache.get()]
 
 def wallet_balance(accountId = ""):
     """ Request Handling for Wallet Balance
@@ -234,8 +240,8 @@ def deposit_to_intents(amount, token_symbol="", sender=""):
         else:    
             sender = sender or env.env_vars.get("ACCOUNT_ID", "")
         
-        with console.status(f"[bold green]Depositing {amount} {token_symbol}... This may take up to 15 minutes.[/bold green]"):
-            asyncio.run(_deposit_to_intents(env, data, amount, sender, token_symbol))
+        with status(f"[bold green]Depositing {amount} {token_symbol}... This may take up to 15 minutes.[/bold green]"):
+            zcash.run_sync(_deposit_to_intents(env, data, amount, sender, token_symbol))
         return f"Deposit of {amount} {token_symbol} completed"
     except Exception as e:
         return f"Error depositing: {str(e)}"
@@ -244,12 +250,28 @@ def deposit_to_intents(amount, token_symbol="", sender=""):
 def swap_in_intents(token_in, amount_in, token_out):
     """Always re-ask for user confirmation regarding the amount and the token-in and token-out before calling the tool each time. This tool swaps token-in to token-out inside defuse/intents. Remember, this is a swap inside intents, and not a swap in the user's wallet. You can call this tool if user asks to swap inside defuse/intents contract, after user confirmation regarding the amount-in, token-in and token-out. Take the amount and token symbols from the user, and call this tool."""
     try:
-        with console.status(f"[bold green]Swapping {amount_in} {token_in} to {token_out}...[/bold green]"):
-            asyncio.run(intent_swap(env, token_in, token_out, amount_in, data))
+        with status(f"[bold green]Swapping {amount_in} {token_in} to {token_out}...[/bold green]"):
+            zcash.run_sync(intent_swap(env, token_in, token_out, amount_in, data))
         return f"Swap of {amount_in} {token_in} to {token_out} completed"
     except Exception as e:
         return f"Error swapping: {str(e)}"
 
+def preview_swap(token_in, amount_in, token_out, compare_amounts=""):
+    """This tool estimates how much token-out a swap of amount-in token-in would return, without swapping anything. Call it when the user asks what a swap would give, or before asking them to confirm a swap. compare_amounts is an optional comma-separated list of other amounts of token-in to compare rates for. Estimates come from recent quotes when available, otherwise the solvers are asked for all amounts at once. The final amount is only fixed when the swap is quoted."""
+    try:
+        amounts = [str(amount_in)] + [a.strip() for a in str(compare_amounts).split(",") if a.strip()]
+        estimates = {amount: preview_intent_swap(token_in, token_out, amount, data) for amount in amounts}
+
+        missing = [amount for amount, estimate in estimates.items() if estimate is None]
+        if missing:
+            estimates.update(zcash.run_sync(quote_intent_swap_tiers(token_in, token_out, missing, data)))
+
+        lines = [f"{amount} {token_in} -> ~{estimate:.6f} {token_out}" if estimate is not None else f"{amount} {token_in} -> no quote available"
+                 for amount, estimate in estimates.items()]
+        return "Estimated swap output:\n" + "\n".join(lines)
+    except Exception as e:
+        return f"Error previewing swap: {str(e)}"
+
 def _withdraw_from_intents(amount, token_symbol="", receiverId=""):
     """Before calling the tool, always reconfirm with the user regarding the amount and token they want to withdraw. If the user requests a withdrawal from the defuse/intents contract, explicitly ask for confirmation on the amount and token symbol before proceeding.
 
@@ -269,7 +291,7 @@ def _withdraw_from_intents(amount, token_symbol="", receiverId=""):
         if not valid_chains:
             return f"Error: {receiverId} is not a valid address for any chain we support"
 
-        match = [obj for obj in data if obj["symbol"] == token_symbol.upper() and obj["blockchain"] in valid_chains]
+        match = [obj for obj in data.by_symbol(token_symbol) if obj["blockchain"] in valid_chains]
 
         if not match:
             return f"Token {token_symbol} may not be supported for withdrawing into {receiverId} for chains {valid_chains}. Please confirm your token and address again."
@@ -291,29 +313,58 @@ def _withdraw_from_intents(amount, token_symbol="", receiverId=""):
     token_data = match[0]
     
     if token_symbol.upper() == "ZEC":
-        with console.status(f"[bold green]Withdrawing {amount} {token_symbol}... This may take up to 15 minutes.[/bold green]"):    
+        with status(f"[bold green]Withdrawing {amount} {token_symbol}... This may take up to 15 minutes.[/bold green]"):    
             receiverId = receiverId if receiverId else  env.env_vars.get("ZCASH_ADDRESS", None)
-            asyncio.run(zcash.withdraw(env, token_symbol, amount, receiverId, data))
+            zcash.run_sync(zcash.withdraw(env, token_symbol, amount, receiverId, data))
             return
 
-    with console.status(f"[bold green]Withdrawing {amount} {token_symbol}... This may take up to 15 minutes.[/bold green]"):    
-        asyncio.run(withdraw_from_intents(env, token_symbol, amount, receiverId, data, token_data))
+    with status(f"[bold green]Withdrawing {amount} {token_symbol}... This may take up to 15 minutes.[/bold green]"):    
+        zcash.run_sync(withdraw_from_intents(env, token_symbol, amount, receiverId, data, token_data))
 
 def swap(token_in, amount_in, token_out, receiverId = env.env_vars.get("ACCOUNT_ID", None), sender = env.env_vars.get("ACCOUNT_ID", None)):
     """Before calling the tool, always reconfirm with the user regarding the amount and token they want to swap. This tool swaps token-in to token-out in the user's wallet. It deposits, then swaps and then withdraws to the withdrawal address. This is not to be called if the swap is in the intents contract."""
     
-    with console.status(f"[bold green]Depositing {amount_in} {token_in}... This may take up to 15 minutes.[/bold green]"):
-        if token_in.upper() == "ZEC":
-            if (sender == env.env_vars.get("ACCOUNT_ID", None)):
-                sender = env.env_vars.get("ZCASH_ADDRESS", None)
-            sender = sender if sender != "" else  env.env_vars.get("ZCASH_ADDRESS", None)
-
-        else:    
-            sender = sender if sender != "" else  env.env_vars.get("ACCOUNT_ID", None)
-        asyncio.run(_deposit_to_intents(env, data, amount_in, sender, token_in))
+    with journal.operation(env, "swap", token_in=token_in, amount_in=amount_in, token_out=token_out, receiverId=receiverId, sender=sender) as op:
+        return _swap(op, token_in, amount_in, token_out, receiverId, sender)
+
+@journal.resumer("swap")
+async def _resume_swap(env, op):
+    def resume():
+        with journal.operation(env, "swap", op):
+            return _swap(op, **op.params)
+    # _swap blocks on zcash.run_sync, so it must not run on the resumer's loop.
+    return await asyncio.to_thread(resume)
+
+def _swap(op, token_in, amount_in, token_out, receiverId, sender):
+    # A step that fails ends the operation; resuming it would run the next
+    # step without the funds this one should have provided.
+    if not _swap_steps(op, token_in, amount_in, token_out, receiverId, sender):
+        op.finish("failed")
+        return False
+    return True
+
+def _swap_steps(op, token_in, amount_in, token_out, receiverId, sender):
+    if op.get("deposited") is None:
+        with status(f"[bold green]Depositing {amount_in} {token_in}... This may take up to 15 minutes.[/bold green]"):
+            if token_in.upper() == "ZEC":
+                if (sender == env.env_vars.get("ACCOUNT_ID", None)):
+                    sender = env.env_vars.get("ZCASH_ADDRESS", None)
+                sender = sender if sender != "" else  env.env_vars.get("ZCASH_ADDRESS", None)
+
+            else:    
+                sender = sender if sender != "" else  env.env_vars.get("ACCOUNT_ID", None)
+            deposited = zcash.run_sync(_deposit_to_intents(env, data, amount_in, sender, token_in, op))
+        if not deposited:
+            return False
+        op.record("deposited")
 
-    with console.status(f"[bold green]Swapping {amount_in} {token_in} to {token_out}...[/bold green]"):
-        amount = asyncio.run(intent_swap(env, token_in, token_out, amount_in, data))
+    amount = op.get("swapped", "amount")
+    if amount is None:
+        with status(f"[bold green]Swapping {amount_in} {token_in} to {token_out}...[/bold green]"):
+            amount = zcash.run_sync(intent_swap(env, token_in, token_out, amount_in, data, op=op))
+        if not amount:
+            return False
+        op.record("swapped", amount=amount)
         
     receiverId = receiverId if receiverId else env.env_vars.get("ACCOUNT_ID", None)
 
@@ -321,38 +372,80 @@ def swap(token_in, amount_in, token_out, receiverId = env.env_vars.get("ACCOUNT_
         if (receiverId == env.env_vars.get("ACCOUNT_ID", None)):
             receiverId = env.env_vars.get("ZCASH_ADDRESS", None)
 
-    valid_chains = utils.getAddressChains(env, receiverId)
+    token_data = data.by_asset_id(op.get("withdraw_token", "defuse_asset_id"))
 
-    if not valid_chains:
-        env.add_reply(f"It seems {receiverId} is not a valid address for any chain we support")
-        return False
+    if token_data is None:
+        valid_chains = utils.getAddressChains(env, receiverId)
 
-    match = [obj for obj in data if obj["symbol"] == token_out.upper() and obj["blockchain"] in valid_chains]
+        if not valid_chains:
+            env.add_reply(f"It seems {receiverId} is not a valid address for any chain we support")
+            return False
 
-    if not match:
-        env.add_reply(f"Token {token_out} may not be supported for withdrawing into {receiverId} for chains {valid_chains}. Please confirm your token and address again.")
-        return False
+        match = [obj for obj in data.by_symbol(token_out) if obj["blockchain"] in valid_chains]
 
-    while len(match) > 1:
-        rprint(f"To which blockchain do you wish to withdraw? Do make sure to write the exact chain.")
-        rprint([data["blockchain"] for data in match])
-        chain = input("> ")
-        match = [obj for obj in match if obj["blockchain"] == chain]
-    
         if not match:
-            env.add_reply(f"Token {token_out} may not be supported for withdrawing into {receiverId} for chain {chain}. Please confirm your token and address again.")
+            env.add_reply(f"Token {token_out} may not be supported for withdrawing into {receiverId} for chains {valid_chains}. Please confirm your token and address again.")
             return False
+
+        while len(match) > 1:
+            if threading.current_thread() is not threading.main_thread():
+                env.add_reply(f"Token {token_out} can be withdrawn to {receiverId} on several chains {[obj['blockchain'] for obj in match]}; a background swap cannot ask which one.")
+                return False
+            rprint(f"To which blockchain do you wish to withdraw? Do make sure to write the exact chain.")
+            rprint([data["blockchain"] for data in match])
+            chain = input("> ")
+            match = [obj for obj in match if obj["blockchain"] == chain]
         
-    token_data = match[0]
+            if not match:
+                env.add_reply(f"Token {token_out} may not be supported for withdrawing into {receiverId} for chain {chain}. Please confirm your token and address again.")
+                return False
+            
+        token_data = match[0]
+        op.record("withdraw_token", defuse_asset_id=token_data["defuse_asset_id"])
     
     if token_out.upper() == "ZEC":
-        with console.status(f"[bold green]Withdrawing {amount} {token_out}... This may take up to 15 minutes.[/bold green]"):    
+        with status(f"[bold green]Withdrawing {amount} {token_out}... This may take up to 15 minutes.[/bold green]"):    
             receiverId = receiverId if receiverId else  env.env_vars.get("ZCASH_ADDRESS", None)
-            asyncio.run(zcash.withdraw(env, token_out, amount, receiverId, data))
-            return
+            return zcash.run_sync(zcash.withdraw(env, token_out, amount, receiverId, data, op))
+
+    with status(f"[bold green]Withdrawing {amount} {token_out}... This may take up to 15 minutes.[/bold green]"):    
+        return zcash.run_sync(withdraw_from_intents(env, token_out, amount, receiverId, data, token_data, op))
+
+
+
+# Wallet operations for the web server's background jobs. Unlike the chat
+# tools above they do not turn errors into reply text: they raise, or return
+# a falsy value when the operation did not complete.
 
-    with console.status(f"[bold green]Withdrawing {amount} {token_out}... This may take up to 15 minutes.[/bold green]"):    
-        asyncio.run(withdraw_from_intents(env, token_out, amount, receiverId, data, token_data))
+def deposit_job(amount, token_symbol="", sender=""):
+    if token_symbol.upper() == "ZEC":
+        sender = sender or env.env_vars.get("ZCASH_ADDRESS", "")
+    else:
+        sender = sender or env.env_vars.get("ACCOUNT_ID", "")
+    return zcash.run_sync(_deposit_to_intents(env, data, amount, sender, token_symbol))
+
+def swap_in_intents_job(token_in, amount_in, token_out):
+    return zcash.run_sync(intent_swap(env, token_in, token_out, amount_in, data))
+
+def withdraw_job(amount, token_symbol="", receiverId="", chain=""):
+    """`chain` picks the token's chain when it can be withdrawn to `receiverId` on several."""
+    receiverId = receiverId or env.env_vars.get("ACCOUNT_ID", None)
+    if token_symbol.upper() == "ZEC" and receiverId == env.env_vars.get("ACCOUNT_ID", None):
+        receiverId = env.env_vars.get("ZCASH_ADDRESS", None)
+
+    valid_chains = utils.getAddressChains(env, receiverId)
+    if not valid_chains:
+        raise ValueError(f"{receiverId} is not a valid address for any chain we support")
+
+    match = [obj for obj in data.by_symbol(token_symbol) if obj["blockchain"] in valid_chains and (not chain or obj["blockchain"] == chain)]
+    if not match:
+        raise ValueError(f"Token {token_symbol} may not be supported for withdrawing into {receiverId} for chains {valid_chains}")
+    if len(match) > 1:
+        raise ValueError(f"Token {token_symbol} can be withdrawn on {[obj['blockchain'] for obj in match]}; pass chain to pick one")
+
+    if token_symbol.upper() == "ZEC":
+        return zcash.run_sync(zcash.withdraw(env, token_symbol, amount, receiverId, data))
+    return zcash.run_sync(withdraw_from_intents(env, token_symbol, amount, receiverId, data, match[0]))
 
 
 
@@ -360,9 +453,13 @@ def run(env: Environment):
 
     # return zcash.transfer(env, "u1rqpc382a2yxjmvqn68r226nhnmqwk38mz9wgg4rrm27vr8paes5jsywp8umkt8ks6huy7fcm2cc0ultx6ztu05ut5y4p20j48u3g8macdrda5gtuyurhqj9zsklc3l6fnjmcn30wk2rd0derh3zezs3quk7efe4xf0qm7da7tpg5vukhvvtfvfutkqm6dhtp9xy58su4j0djwuas63l", "0.0623", "zs1q7k4z0cyn2lah5m3l7aptrnssgg7f2dk6mjygqsh20s0mqhtjsjaq9l00w0qxj2cvfjk72yqhr4", args)
 
+    # Pick up deposit/swap/withdraw flows a previous process left unfinished.
+    zcash.run_sync(journal.resume(env))
+
     tool_registry = env.get_tool_registry(new=True)
     tool_registry.register_tool(deposit_to_intents)
     tool_registry.register_tool(swap_in_intents)
+    tool_registry.register_tool(preview_swap)
     tool_registry.register_tool(_withdraw_from_intents)
     tool_registry.register_tool(wallet_balance)
     tool_registry.register_tool(Intents_balance)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe cache of `(account, asset)` entries that expire after `ttl` seconds.
+
+    Expired entries are dropped when read, and writes sweep out the ones
+    nobody reads again at most once per `ttl`.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._swept = time.time()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        # Called with the lock held.
+        if now - self._swept < self.ttl:
+            return
+        self._swept = now
+        for key in [k for k, (_, stored_at) in self._entries.items() if now - stored_at > self.ttl]:
+            del self._entries[key]
+
+    def get(self, account, asset, default=None):
+        with self._lock:
+            entry = self._entries.get((account, asset))
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[(account, asset)]
+                return default
+            return value
+
+    def get_many(self, account, assets):
+        """Return `{asset: value}` for the assets of `account` still cached."""
+        hits = {}
+        for asset in assets:
+            value = self.get(account, asset)
+            if value is not None:
+                hits[asset] = value
+        return hits
+
+    def put(self, account, asset, value):
+        now = time.time()
+        with self._lock:
+            self._entries[(account, asset)] = (value, now)
+            self._sweep(now)
+
+    def put_many(self, account, values):
+        now = time.time()
+        with self._lock:
+            for asset, value in values.items():
+                self._entries[(account, asset)] = (value, now)
+            self._sweep(now)
+
+    def invalidate(self, account=None, asset=None):
+        """Drop the entries matching `account` and/or `asset` (everything if neither is given)."""
+        with self._lock:
+            for key in list(self._entries):
+                if (account is None or key[0] == account) and (asset is None or key[1] == asset):
+                    del self._entries[key]
+
+
+# Balances change only when a block lands or when we move funds ourselves, and
+# our own deposit/swap/withdraw/transfer flows invalidate what they touch.
+balance_cache = TTLCache(ttl=5)
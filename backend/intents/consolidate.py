@@ -0,0 +1,63 @@
+import asyncio
+from decimal import Decimal
+
+from intents.signer import get_signer
+from intents.utils import add_public_key, mt_batch_balance_of
+
+CONSOLIDATION_CONCURRENCY = 3
+
+
+def plan_consolidation(balances, target, amount):
+    """Pick the fewest source balances that cover `amount` of the `target` asset.
+
+    `balances` maps defuse_asset_id -> token amount (Decimal) for every asset
+    of one symbol. Sources are taken largest first, so the plan is the
+    minimal number of swaps; each chosen source is swapped in full. Returns
+    a list of `(defuse_asset_id, amount)` swaps, empty if `target` already
+    holds enough. If all sources together fall short, all of them are used.
+    """
+    shortfall = Decimal(amount) - balances.get(target, Decimal(0))
+    plan = []
+    sources = sorted(((a, b) for a, b in balances.items() if a != target and b > 0), key=lambda item: item[1], reverse=True)
+    for asset_id, balance in sources:
+        if shortfall <= 0:
+            break
+        plan.append((asset_id, balance))
+        shortfall -= balance
+    return plan
+
+
+async def consolidate(env, near, account_id, tokens, target, amount, swap, data, concurrency=CONSOLIDATION_CONCURRENCY):
+    """Swap other-chain balances of `target`'s symbol into `target` until `amount` is covered.
+
+    `tokens` are the TokenRecords sharing the symbol, `amount` is a token
+    amount of `target`, and `swap` is the swap coroutine function
+    (`_intent_swap`). The planned swaps are independent, so they run
+    concurrently, at most `concurrency` at a time, after the signing key is
+    registered once for all of them. Returns
+    `[(token, amount_in, amount_out), ...]` for the planned swaps, with
+    `amount_out` False/None (or the exception) when a swap failed.
+    """
+    by_asset_id = {token["defuse_asset_id"]: token for token in tokens}
+    units = await mt_batch_balance_of(near, account_id, list(by_asset_id))
+    balances = {asset_id: token.from_units(u) for (asset_id, token), u in zip(by_asset_id.items(), units)}
+
+    plan = plan_consolidation(balances, target["defuse_asset_id"], amount)
+    if not plan:
+        return []
+
+    # Each swap would otherwise register the key itself, racing on the nonce
+    await add_public_key(env, get_signer(env).public_key)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(asset_id, amount_in):
+        async with semaphore:
+            return await swap(env, by_asset_id[asset_id]["symbol"], target["symbol"], amount_in, data, asset_id, target["defuse_asset_id"],
+                              register_key=False)
+
+    results = await asyncio.gather(*(run(asset_id, amount_in) for asset_id, amount_in in plan), return_exceptions=True)
+    for (asset_id, _), result in zip(plan, results):
+        if isinstance(result, Exception):
+            print(f"Consolidating {asset_id} failed: {result}")
+    return [(by_asset_id[asset_id], amount_in, result) for (asset_id, amount_in), result in zip(plan, results)]
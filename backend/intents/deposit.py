@@ -1,18 +1,18 @@
-import json
+import asyncio
 from decimal import Decimal
 
 import requests
 from nearai.agents.environment import Environment
 
 import zcash
+from balance_cache import balance_cache
+from intents.utils import storage_cache, storage_deposit_needed
+from progress import emit
+from scheduler import get_scheduler
+from token_registry import registry_for
 
 default_mainnet_rpc = "https://rpc.mainnet.near.org"
 
-import re
-
-with open("tokens.json", "r") as file:
-    data = json.load(file)
-
 INTENTS_CONTRACT = "intents.near"
 url = "https://solver-relay-v2.chaindefuser.com/rpc"
 
@@ -27,12 +27,12 @@ FT_TRANSFER_GAS = 50000000000000
 FT_MINIMUM_STORAGE_BALANCE_LARGE = 1250000000000000000000
 
 
-async def _deposit_to_intents(env: Environment, data, amount, sender, token_symbol = ""):
+async def _deposit_to_intents(env: Environment, data, amount, sender, token_symbol = "", op=None):
     
-    supported_data = data
+    supported_data = registry_for(data)
     user_account_id = env.env_vars.get("ACCOUNT_ID")
     user_private_key = env.env_vars.get("PRIVATE_KEY")
-    matches = [obj for obj in supported_data if obj["symbol"] == token_symbol.upper() and obj["blockchain"] in ("near", "zec")]
+    matches = [obj for obj in supported_data.by_symbol(token_symbol) if obj["blockchain"] in ("near", "zec")]
     
     if not matches:
       env.add_reply(f"Token {token_symbol} may not be supported. Please confirm your token again.")
@@ -40,73 +40,79 @@ async def _deposit_to_intents(env: Environment, data, amount, sender, token_symb
   
     token = matches[0]
     if token["symbol"] == "ZEC":
-        txid = await zcash.deposit(env, sender, amount)
-        return True
+        txid = await zcash.deposit(env, sender, amount, op)
+        balance_cache.invalidate(user_account_id)
+        return bool(txid)
     
-    amount = Decimal(amount) * Decimal(10) ** int(token["decimals"])
-    amount = int(amount) 
-    contract_id = token["defuse_asset_id"].replace("nep141:", "")
-
-    near = env.set_near(user_account_id, user_private_key)
-
-    nep141balance = await near.view(
-        contract_id="wrap.near",
-        method_name="storage_balance_of",
-        args={
-            "account_id": user_account_id
-        }
-    )
-    
-    if nep141balance.result:
-        nep141balance = int(nep141balance.result['available'])
-    else:
-        nep141balance = 0
+    # On-chain actions of one NEAR account run one at a time, so concurrent
+    # deposits do not race on storage deposits or the access key nonce.
+    async with get_scheduler(env).hold_async(("near", user_account_id)):
+        amount = token.to_units(amount)
+        contract_id = token["defuse_asset_id"].replace("nep141:", "")
 
-    storage_payment = FT_MINIMUM_STORAGE_BALANCE_LARGE - nep141balance
+        # A resumed operation whose transfer already went through is done.
+        if op is not None and op.get("ft_transfer", "transaction_hash"):
+            return True
 
-    if contract_id == "wrap.near":
+        near = env.set_near(user_account_id, user_private_key)
 
-        token_response = requests.get(f"https://api.fastnear.com/v1/account/{user_account_id}/ft")
-        token_response.raise_for_status()
+        # wNEAR lands in the user's own wrap.near account first; every other token
+        # is sent straight to intents.near, which must be registered on it.
+        storage_account = user_account_id if contract_id == "wrap.near" else INTENTS_CONTRACT
+        storage_payment = await storage_deposit_needed(near, contract_id, storage_account)
 
-        tokens = token_response.json().get("tokens", [])
-        near_balance = int(next((token["balance"] for token in tokens if token["contract_id"] == "wrap.near"), 0))
+        if contract_id == "wrap.near":
 
-        near_amount = 0 if amount - near_balance < 0 else (amount) - near_balance
+            token_response = await asyncio.to_thread(requests.get, f"https://api.fastnear.com/v1/account/{user_account_id}/ft")
+            token_response.raise_for_status()
 
-        if (storage_payment > 0 or near_amount > 0):
-            tr = await near.call(contract_id, "near_deposit", {}, FT_DEPOSIT_GAS, storage_payment + near_amount)
-            if "SuccessValue" not in tr.status:
-                return False
+            tokens = token_response.json().get("tokens", [])
+            near_balance = int(next((token["balance"] for token in tokens if token["contract_id"] == "wrap.near"), 0))
+
+            near_amount = 0 if amount - near_balance < 0 else (amount) - near_balance
+
+            if (storage_payment > 0 or near_amount > 0) and (op is None or op.get("near_deposit") is None):
+                tr = await near.call(contract_id, "near_deposit", {}, FT_DEPOSIT_GAS, storage_payment + near_amount)
+                storage_cache.invalidate(user_account_id, contract_id)
+                if "SuccessValue" not in tr.status:
+                    return False
+                if op is not None:
+                    op.record("near_deposit", transaction_hash=tr.transaction.hash)
             
-        tr = await near.call(contract_id, "ft_transfer_call",
-                {"receiver_id": INTENTS_CONTRACT, "amount": str(amount), "msg": ""},
-                FT_TRANSFER_GAS,
-                1)
+            tr = await near.call(contract_id, "ft_transfer_call",
+                    {"receiver_id": INTENTS_CONTRACT, "amount": str(amount), "msg": ""},
+                    FT_TRANSFER_GAS,
+                    1)
         
-        if "SuccessValue" not in tr.status:
-                return False
+            if "SuccessValue" not in tr.status:
+                    return False
     
-    else:
-      if storage_payment > 0:
-        tr = await near.call(contract_id, "storage_deposit",
-                {
-                  "account_id": INTENTS_CONTRACT,
-                #   "registration_only": True,
-                },
-                FT_DEPOSIT_GAS, storage_payment)
+        else:
+          if storage_payment > 0:
+            tr = await near.call(contract_id, "storage_deposit",
+                    {
+                      "account_id": INTENTS_CONTRACT,
+                    #   "registration_only": True,
+                    },
+                    FT_DEPOSIT_GAS, storage_payment)
+            storage_cache.invalidate(INTENTS_CONTRACT, contract_id)
         
-        if "SuccessValue" not in tr.status:
-            return False
+            if "SuccessValue" not in tr.status:
+                return False
         
-      tr = await near.call(contract_id, "ft_transfer_call",
-            {"receiver_id": INTENTS_CONTRACT, "amount": str(amount), "msg": ""},
-              FT_TRANSFER_GAS,
-            1)
+          tr = await near.call(contract_id, "ft_transfer_call",
+                {"receiver_id": INTENTS_CONTRACT, "amount": str(amount), "msg": ""},
+                  FT_TRANSFER_GAS,
+                1)
       
-      if "SuccessValue" not in tr.status:
-            return False
+          if "SuccessValue" not in tr.status:
+                return False
 
-    amount = float(amount) / float(Decimal(10) ** int(token["decimals"]))
-    env.add_reply(f"Transaction Hash: {tr.transaction.hash}")
-    return True
+        if op is not None:
+            op.record("ft_transfer", transaction_hash=tr.transaction.hash)
+        emit("txid", chain="near", transaction_hash=tr.transaction.hash)
+
+        balance_cache.invalidate(user_account_id)
+        amount = float(amount) / float(Decimal(10) ** int(token["decimals"]))
+        env.add_reply(f"Transaction Hash: {tr.transaction.hash}")
+        return True
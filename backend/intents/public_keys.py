@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+import time
+
+DEFAULT_PATH = "public_keys.json"
+DEFAULT_REVALIDATE_INTERVAL = 24 * 60 * 60
+
+
+class PublicKeyRegistry:
+    """(account_id, public_key) pairs known to be registered on intents.near.
+
+    A pair is recorded after `has_public_key` confirmed it or `add_public_key`
+    succeeded, and is trusted for `revalidate_interval` seconds before it is
+    checked on chain again. The pairs are persisted to `path` as JSON so a
+    restart does not re-check every key.
+    """
+    def __init__(self, path=DEFAULT_PATH, revalidate_interval=DEFAULT_REVALIDATE_INTERVAL):
+        self.path = path
+        self.revalidate_interval = revalidate_interval
+
+        self._verified = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as file:
+                self._verified = {tuple(k.split(" ", 1)): at for k, at in json.load(file).items()}
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _save(self):
+        if not self.path:
+            return
+        # Written to a temp file and renamed, so a crash mid-write cannot
+        # leave a truncated registry behind.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump({f"{account} {key}": at for (account, key), at in self._verified.items()}, file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not persist public key registry: {e}")
+
+    def is_registered(self, account_id, public_key):
+        with self._lock:
+            verified_at = self._verified.get((account_id, str(public_key)))
+        return verified_at is not None and time.time() - verified_at <= self.revalidate_interval
+
+    def mark_registered(self, account_id, public_key):
+        with self._lock:
+            self._verified[(account_id, str(public_key))] = time.time()
+            self._save()
+
+    def forget(self, account_id, public_key):
+        with self._lock:
+            if self._verified.pop((account_id, str(public_key)), None) is not None:
+                self._save()
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_public_key_registry(env_vars) -> PublicKeyRegistry:
+    """Return the registry for the PUBLIC_KEY_CACHE_FILE configured in `env_vars`."""
+    path = env_vars.get("PUBLIC_KEY_CACHE_FILE", DEFAULT_PATH)
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            interval = float(env_vars.get("PUBLIC_KEY_REVALIDATE_INTERVAL", DEFAULT_REVALIDATE_INTERVAL))
+            registry = _registries[path] = PublicKeyRegistry(path, interval)
+        return registry
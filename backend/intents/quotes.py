@@ -0,0 +1,235 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from intents.utils import relay_session, url
+
+QUOTE_DEADLINE = 5
+QUOTE_SAFETY_MARGIN = 5
+QUOTE_BUCKET_PRECISION = 0.01
+
+
+class QuoteError(Exception):
+    """The solver relay could not be reached or rejected the quote request"""
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        # Transport errors and 5xx answers may pass; a rejected request will not
+        self.retryable = retryable
+
+
+def expiration_timestamp(expiration_time):
+    """Parse a quote's `expiration_time` (e.g. 2025-01-21T14:55:40.323Z) to epoch seconds."""
+    return datetime.fromisoformat(expiration_time.replace("Z", "+00:00")).timestamp()
+
+
+def _post_quote(asset_in, asset_out, amount_in, timeout):
+    try:
+        response = relay_session.post(url, json={
+            "id": 1,
+            "jsonrpc": "2.0",
+            "method": "quote",
+            "params": [
+                {
+                    "defuse_asset_identifier_in": asset_in,
+                    "defuse_asset_identifier_out": asset_out,
+                    "exact_amount_in": str(amount_in)
+                }
+            ]
+        }, timeout=timeout)
+    except requests.exceptions.RequestException as err:
+        raise QuoteError(f"Could not reach the solver relay: {err}", retryable=True)
+    try:
+        response.raise_for_status()
+        return response.json().get("result")
+    except Exception as err:
+        raise QuoteError(f"HTTP error occurred: {err}. Error details: {response.text}", retryable=response.status_code >= 500)
+
+
+async def request_quotes(asset_in, asset_out, amount_in, deadline=None, base_delay=0.25, max_delay=2):
+    """Ask the relay for quotes on one exact input amount until some arrive.
+
+    Empty answers, transport errors and 5xx answers are retried with
+    exponential backoff and jitter until the absolute `deadline` (epoch
+    seconds). Returns an empty list if no quotes came, or raises the last
+    QuoteError if the relay was still failing at the deadline.
+    """
+    deadline = deadline or time.time() + QUOTE_DEADLINE
+    delay = base_delay
+    while True:
+        remaining = deadline - time.time()
+        error = None
+        try:
+            quotes = await asyncio.to_thread(_post_quote, asset_in, asset_out, amount_in, max(remaining, 0.5))
+        except QuoteError as e:
+            if not e.retryable:
+                raise
+            error, quotes = e, None
+        if quotes:
+            return quotes
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            if error is not None:
+                raise error
+            return []
+        await asyncio.sleep(min(remaining, random.uniform(delay / 2, delay)))
+        delay = min(delay * 2, max_delay)
+
+
+def rank_quotes(quotes, safety_margin=QUOTE_SAFETY_MARGIN, now=None):
+    """Best-first list of the quotes that stay valid for at least `safety_margin` seconds.
+
+    Quotes are ranked by the output they deliver per unit of input, so quotes
+    for different amount tiers compare fairly.
+    """
+    now = now or time.time()
+    usable = [
+        quote for quote in quotes
+        if quote.get("quote_hash") and int(quote.get("amount_in") or 0) > 0
+        and expiration_timestamp(quote["expiration_time"]) - now >= safety_margin
+    ]
+    return sorted(usable, key=lambda quote: (int(quote["amount_out"]) / int(quote["amount_in"]), int(quote["amount_out"])), reverse=True)
+
+
+class QuoteCache:
+    """Recent relay quotes keyed by (asset_in, asset_out, amount bucket).
+
+    Amounts are bucketed logarithmically, so amounts within `precision` of
+    each other share a bucket. Entries live until their quote's
+    `expiration_time` (minus `safety_margin`) and are evicted on access
+    after that; `put` also sweeps every bucket at most once per
+    `sweep_interval` seconds, so buckets that are never read again do not
+    pile up. A quote that gets published is discarded so it is never
+    handed out twice.
+    """
+    def __init__(self, precision=QUOTE_BUCKET_PRECISION, safety_margin=QUOTE_SAFETY_MARGIN, sweep_interval=60):
+        self.precision = precision
+        self.safety_margin = safety_margin
+        self.sweep_interval = sweep_interval
+        self._entries = {}
+        self._swept = time.time()
+        self._lock = threading.Lock()
+
+    def _key(self, asset_in, asset_out, amount_in):
+        amount_in = int(amount_in)
+        bucket = round(math.log(amount_in) / math.log1p(self.precision)) if amount_in > 0 else 0
+        return asset_in, asset_out, bucket
+
+    def put(self, quotes):
+        now = time.time()
+        with self._lock:
+            for quote in quotes:
+                key = self._key(quote["defuse_asset_identifier_in"], quote["defuse_asset_identifier_out"], quote["amount_in"])
+                expires_at = expiration_timestamp(quote["expiration_time"]) - self.safety_margin
+                if expires_at > now:
+                    self._entries.setdefault(key, {})[quote["quote_hash"]] = (quote, expires_at)
+            if now - self._swept >= self.sweep_interval:
+                self._swept = now
+                for key in list(self._entries):
+                    self._live(key, now)
+
+    def _live(self, key, now):
+        # Called with the lock held; evicts the expired quotes of one bucket.
+        entries = self._entries.get(key, {})
+        for quote_hash in [h for h, (_, expires_at) in entries.items() if expires_at <= now]:
+            del entries[quote_hash]
+        if not entries:
+            self._entries.pop(key, None)
+        return [quote for quote, _ in entries.values()]
+
+    def get(self, asset_in, asset_out, amount_in):
+        """Usable cached quotes for the bucket of `amount_in`, best first."""
+        now = time.time()
+        with self._lock:
+            quotes = self._live(self._key(asset_in, asset_out, amount_in), now)
+        return rank_quotes(quotes, 0, now)
+
+    def near(self, asset_in, asset_out, amount_in):
+        """Usable cached quotes within `precision` of `amount_in`, closest amount first.
+
+        Looks at the neighbouring buckets too, so amounts just across a
+        bucket boundary still match.
+        """
+        asset_in, asset_out, bucket = self._key(asset_in, asset_out, amount_in)
+        amount_in = int(amount_in)
+        now = time.time()
+        with self._lock:
+            quotes = [q for b in (bucket - 1, bucket, bucket + 1) for q in self._live((asset_in, asset_out, b), now)]
+        quotes = [q for q in quotes if abs(int(q["amount_in"]) - amount_in) <= amount_in * self.precision]
+        return sorted(quotes, key=lambda q: abs(int(q["amount_in"]) - amount_in))
+
+    def exact(self, asset_in, asset_out, amount_in):
+        """The best cached quote for exactly `amount_in`, usable for publishing."""
+        return next((q for q in self.get(asset_in, asset_out, amount_in) if int(q["amount_in"]) == int(amount_in)), None)
+
+    def discard(self, quote):
+        key = self._key(quote["defuse_asset_identifier_in"], quote["defuse_asset_identifier_out"], quote["amount_in"])
+        with self._lock:
+            self._entries.get(key, {}).pop(quote["quote_hash"], None)
+
+
+quote_cache = QuoteCache()
+
+
+def preview_quote(asset_in, asset_out, amount_in):
+    """Estimate a swap from cached quotes only, without calling the relay.
+
+    Scales the cached quote with the closest amount to `amount_in`.
+    Returns None if nothing usable is cached.
+    """
+    quotes = quote_cache.near(asset_in, asset_out, amount_in)
+    if not quotes:
+        return None
+    quote = quotes[0]
+    amount_out = int(quote["amount_out"]) * int(amount_in) // int(quote["amount_in"])
+    return {
+        "defuse_asset_identifier_in": asset_in,
+        "defuse_asset_identifier_out": asset_out,
+        "amount_in": str(int(amount_in)),
+        "amount_out": str(amount_out),
+        "expiration_time": quote["expiration_time"],
+        "preview": True,
+    }
+
+
+async def quote_tiers(asset_in, asset_out, amounts, deadline=None, safety_margin=QUOTE_SAFETY_MARGIN):
+    """Quote several input amounts (tiers or split sizes) concurrently.
+
+    Returns `{amount: ranked quotes}`; a tier whose request failed maps to [].
+    """
+    deadline = deadline or time.time() + QUOTE_DEADLINE
+    results = await asyncio.gather(
+        *(request_quotes(asset_in, asset_out, amount, deadline) for amount in amounts),
+        return_exceptions=True,
+    )
+
+    tiers = {}
+    for amount, quotes in zip(amounts, results):
+        if isinstance(quotes, Exception):
+            print(f"Quote for {amount} failed: {quotes}")
+            quotes = []
+        quote_cache.put(quotes)
+        tiers[amount] = rank_quotes(quotes, safety_margin)
+    return tiers
+
+
+async def best_quote(asset_in, asset_out, amount_in, deadline=None, safety_margin=QUOTE_SAFETY_MARGIN, use_cache=True):
+    """The best usable quote for exactly `amount_in`, or None if there is none.
+
+    A cached quote for the same exact amount is returned without calling
+    the relay. Raises QuoteError if the relay itself fails.
+    """
+    if use_cache:
+        cached = quote_cache.exact(asset_in, asset_out, amount_in)
+        if cached is not None:
+            return cached
+
+    quotes = await request_quotes(asset_in, asset_out, amount_in, deadline)
+    quote_cache.put(quotes)
+    ranked = rank_quotes(quotes, safety_margin)
+    return ranked[0] if ranked else None
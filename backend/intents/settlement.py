@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from intents.utils import relay_session, url
+from poller import BatchPoller
+
+SETTLED = "SETTLED"
+FAILED_STATES = ("NOT_FOUND_OR_NOT_VALID_ANYMORE", "NOT_FOUND_OR_NOT_VALID", "FAILED")
+
+
+class SettlementWatcher(BatchPoller):
+    """Tracks published intents until the solver relay reports them final.
+
+    One background thread polls every outstanding intent hash with
+    `get_status`; the hashes due in a tick are queried concurrently over the
+    shared keep-alive relay session. Each intent starts at `min_interval`
+    and backs off towards `max_interval` while its status does not change,
+    and gives up after `timeout` seconds. Each intent resolves a Future with
+    `(settled, response)`, the same pair `get_intent_settled_status` returns.
+    """
+    name = "settlement-watcher"
+
+    def __init__(self, min_interval=0.2, max_interval=2.0, backoff=1.5, timeout=30, max_workers=8):
+        super().__init__(error_interval=max_interval)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="settlement-poll")
+
+    def _new_entry(self, intent_hash):
+        now = time.time()
+        return {"next": now + self.min_interval, "interval": self.min_interval, "started": now, "status": None, "response": None}
+
+    def _callback_args(self, intent_hash, result):
+        return (intent_hash, *result)
+
+    @staticmethod
+    def _get_status(intent_hash):
+        response = relay_session.post(url, json={
+            "id": 1,
+            "jsonrpc": "2.0",
+            "method": "get_status",
+            "params": [{"intent_hash": intent_hash}]
+        }, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def _poll(self, intent_hash):
+        try:
+            return intent_hash, self._get_status(intent_hash)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Intent status poll failed for {intent_hash}: {e}")
+            return intent_hash, None
+
+    def _tick(self):
+        now = time.time()
+        with self._lock:
+            due = [h for h, entry in self._entries.items() if entry["next"] <= now]
+
+        resolved = []
+        for intent_hash, resp in self._pool.map(self._poll, due):
+            status = ((resp or {}).get("result") or {}).get("status")
+            now = time.time()
+            with self._lock:
+                entry = self._entries.get(intent_hash)
+                if entry is None:
+                    continue
+                if resp is not None:
+                    entry["response"] = resp
+                if status == SETTLED:
+                    resolved.append((intent_hash, (True, resp)))
+                elif status in FAILED_STATES:
+                    print("Intent not found or not valid anymore" if status != "FAILED" else f"Intent {intent_hash} failed")
+                    resolved.append((intent_hash, (False, resp)))
+                elif now - entry["started"] > self.timeout:
+                    print(f"Timeout: intent {intent_hash} did not settle within {self.timeout} seconds")
+                    resolved.append((intent_hash, (False, entry["response"])))
+                else:
+                    # Poll fast again whenever the status moves, back off while it does not.
+                    entry["interval"] = self.min_interval if status != entry["status"] else min(entry["interval"] * self.backoff, self.max_interval)
+                    entry["status"] = status
+                    entry["next"] = now + entry["interval"]
+        self._resolve(resolved)
+
+        with self._lock:
+            next_poll = min((entry["next"] for entry in self._entries.values()), default=time.time())
+        return next_poll - time.time()
+
+
+settlement_watcher = SettlementWatcher()
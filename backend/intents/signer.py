@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import base58
+import nacl.signing
+from nearai.agents.environment import Environment
+
+from intents.utils import ED_PREFIX, INTENTS_CONTRACT, base64_to_uint8array, generate_nonce, serialize_intent
+
+
+class Signer:
+    """NEP-413 signer for one ed25519 account key.
+
+    The base58 private key is decoded once; the signing key and the derived
+    public key strings are kept for every later signature.
+    """
+    def __init__(self, private_key):
+        private_key_bytes = base58.b58decode(private_key[len(ED_PREFIX):])
+
+        if len(private_key_bytes) != 64:
+            raise ValueError("The private key must be exactly 64 bytes long")
+
+        self.seed = private_key_bytes[:32]
+        self.signing_key = nacl.signing.SigningKey(self.seed)
+        self.public_key_base58 = base58.b58encode(self.signing_key.verify_key.encode()).decode("utf-8")
+        self.public_key = ED_PREFIX + self.public_key_base58
+
+    def sign(self, message_str, recipient=INTENTS_CONTRACT, nonce=None):
+        """Sign one intent message; returns the `signed_data` object for publish_intent."""
+        nonce = nonce or generate_nonce()
+        intent_hash = serialize_intent(message_str, recipient, base64_to_uint8array(nonce))
+        signature = self.signing_key.sign(intent_hash).signature
+
+        return {
+            "payload": {
+                "message": message_str,
+                "nonce": nonce,
+                "recipient": recipient,
+            },
+            "standard": "nep413",
+            "signature": ED_PREFIX + base58.b58encode(signature).decode("utf-8"),
+            "public_key": self.public_key,
+        }
+
+    def sign_many(self, messages, recipient=INTENTS_CONTRACT, processes=None):
+        """Sign a batch of intent messages, returning their `signed_data` in order.
+
+        With `processes`, the batch is split across a process pool; each
+        worker rebuilds the signing key once from the seed.
+        """
+        messages = list(messages)
+        if not processes or len(messages) < 2:
+            return [self.sign(message_str, recipient) for message_str in messages]
+
+        chunksize = max(1, len(messages) // (processes * 4))
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(self.seed, self.public_key)) as pool:
+            return list(pool.map(_sign_in_worker, messages, [recipient] * len(messages), chunksize=chunksize))
+
+
+_worker_signer = None
+
+def _init_worker(seed, public_key):
+    global _worker_signer
+    signer = Signer.__new__(Signer)
+    signer.seed = seed
+    signer.signing_key = nacl.signing.SigningKey(seed)
+    signer.public_key = public_key
+    signer.public_key_base58 = public_key[len(ED_PREFIX):]
+    _worker_signer = signer
+
+def _sign_in_worker(message_str, recipient):
+    return _worker_signer.sign(message_str, recipient)
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+def get_signer(env: Environment) -> Signer:
+    """Return the cached Signer for the PRIVATE_KEY configured in `env`."""
+    private_key = env.env_vars.get("PRIVATE_KEY")
+    with _signers_lock:
+        signer = _signers.get(private_key)
+        if signer is None:
+            signer = _signers[private_key] = Signer(private_key)
+        return signer
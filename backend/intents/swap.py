@@ -1,19 +1,21 @@
-import base64
-import json
-import time
+import asyncio
 from decimal import Decimal
 
-import base58
-import nacl.signing
-import requests
 from nearai.agents.environment import Environment
 
-from intents.utils import add_public_key, get_intent_settled_status, get_swap_message_to_sign, generate_nonce, base64_to_uint8array, serialize_intent
+from balance_cache import balance_cache
+from intents.consolidate import consolidate
+from intents.quotes import QuoteError, best_quote, preview_quote, quote_cache, quote_tiers
+from intents.signer import get_signer
+from intents.settlement import settlement_watcher
+from intents.utils import add_public_key, forget_rejected_key, mt_batch_balance_of, get_swap_message_to_sign, publish_intent
+from progress import emit
+from scheduler import get_scheduler
+from token_registry import registry, registry_for
 
 default_mainnet_rpc = "https://rpc.mainnet.near.org"
 
-with open("tokens.json", "r") as file:
-    data = json.load(file)
+data = registry
 
 INTENTS_CONTRACT = "intents.near"
 url = "https://solver-relay-v2.chaindefuser.com/rpc"
@@ -28,11 +30,13 @@ FT_DEPOSIT_GAS = 30000000000000
 FT_TRANSFER_GAS = 50000000000000
 FT_MINIMUM_STORAGE_BALANCE_LARGE = 1250000000000000000000
 
+PUBLISH_RETRY_DELAYS = (1, 2)
 
-async def intent_swap(env: Environment, token_in, token_out, amount_in, token_data, contract_in = "", contract_out = ""):
-    token_list = [obj for obj in data if obj["symbol"] == token_in.upper()]
+
+async def intent_swap(env: Environment, token_in, token_out, amount_in, token_data, contract_in = "", contract_out = "", op=None):
+    token_list = data.by_symbol(token_in)
     
-    matches_in = [obj for obj in token_data if obj["symbol"] == token_in.upper()]
+    matches_in = registry_for(token_data).by_symbol(token_in)
     
     if not matches_in:
       return False
@@ -43,47 +47,36 @@ async def intent_swap(env: Environment, token_in, token_out, amount_in, token_da
     user_private_key = env.env_vars.get("PRIVATE_KEY")
     
     near = env.set_near(user_account_id, user_private_key)
-    
-    if len(token_list) > 1:
-        contract_list = [obj["defuse_asset_id"] for obj in token_list]
-        tr = await near.view("intents.near", "mt_batch_balance_of",
-                    {
-                        "account_id": user_account_id,
-                        "token_ids": contract_list,
-                    })
-        result = tr.result
-        i = 0
-        j = contract_list.index(token_data_in["defuse_asset_id"])
-        result[j] = Decimal(result[j]) / (Decimal(10) ** int(token_data_in["decimals"]))
-
-        for i, token_obj in enumerate(token_list):
-            if i == j or Decimal(result[i]) == 0:
-                continue
-            result[i] = Decimal(result[i]) / (Decimal(10) ** int(token_obj["decimals"]))
-            if result[j] >= Decimal(amount_in):
-                break
 
-            amount_swapped = await _intent_swap(env, token_obj["symbol"], token_data_in["symbol"], result[i], data, token_obj["defuse_asset_id"], token_data_in["defuse_asset_id"])
-            
-            result[i] = 0
-            result[j] = result[j] + amount_swapped
+    # Swaps are sized from the intents balance like withdrawals, so they take
+    # the same lock from consolidation to settlement. _intent_swap itself
+    # takes none: it also runs for consolidation under a withdrawal's lock.
+    async with get_scheduler(env).hold_async(("intents", user_account_id)):
+        if len(token_list) > 1 and (op is None or op.get("swap_intent") is None):
+            await consolidate(env, near, user_account_id, token_list, token_data_in, amount_in, _intent_swap, data)
 
-            i = i + 1
-            
-    return await _intent_swap(env, token_in, token_out, amount_in, token_data, contract_in, contract_out)
+        return await _intent_swap(env, token_in, token_out, amount_in, token_data, contract_in, contract_out, op)
     
 
-async def _intent_swap(env:Environment, token_in, token_out, amount_in, token_data, contract_in = "", contract_out = ""):
+async def _intent_swap(env:Environment, token_in, token_out, amount_in, token_data, contract_in = "", contract_out = "", op=None, register_key=True):
+    """Swap `amount_in` of `token_in` for `token_out` inside intents; returns the amount received.
+
+    With a journal `op`, the published intent is recorded under
+    `swap_intent`, and a resumed operation waits for that intent instead of
+    quoting and publishing again. `register_key=False` skips registering the
+    signing key, for callers (consolidation) that registered it already.
+    """
     
     user_account_id = env.env_vars.get("ACCOUNT_ID")
     user_private_key = env.env_vars.get("PRIVATE_KEY")
+    token_data = registry_for(token_data)
     
-    matches_in = [obj for obj in token_data if obj["symbol"] == token_in.upper()]
+    matches_in = token_data.by_symbol(token_in)
     
     if not matches_in:
       return False
   
-    matches_out = [obj for obj in token_data if obj["symbol"] == token_out.upper()]
+    matches_out = token_data.by_symbol(token_out)
     
     if not matches_out:
       return False
@@ -98,172 +91,130 @@ async def _intent_swap(env:Environment, token_in, token_out, amount_in, token_da
     if not token_data_out:
         return False
     
-    amount = int(Decimal(amount_in) * Decimal(10) ** int(token_data_in["decimals"]))
-    
-    near = env.set_near(user_account_id)
-    args = {
-        "account_id": user_account_id,
-        "token_ids": [token_data_in["defuse_asset_id"]],
-    }
+    intent_hash = op.get("swap_intent", "intent_hash") if op is not None else None
+    if intent_hash is not None:
+        amount_in = op.get("swap_intent", "amount_in")
+        amount_out = op.get("swap_intent", "amount_out")
+    else:
+        amount = token_data_in.to_units(amount_in)
     
-    tr = await near.view("intents.near", "mt_batch_balance_of", args)
-    if Decimal(amount) > Decimal(tr.result[0]):
-        amount = Decimal(tr.result[0])
+        near = env.set_near(user_account_id)
+        balance_in = (await mt_batch_balance_of(near, user_account_id, [token_data_in["defuse_asset_id"]]))[0]
+        if Decimal(amount) > Decimal(balance_in):
+            amount = Decimal(balance_in)
     
-    data = {
-        "id": 1,
-        "jsonrpc": "2.0",
-        "method": "quote",
-        "params": [
-            {
-                "defuse_asset_identifier_in": token_data_in["defuse_asset_id"],
-                "defuse_asset_identifier_out": token_data_out["defuse_asset_id"],
-                "exact_amount_in": str(amount)
-            }
-        ]
-    }
-
-    max_retries = 5
-    retry_delay = 1
-
-    for attempt in range(max_retries):
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-
         try:
-            response.raise_for_status()
-            parsed_response = response.json()
-
-            if parsed_response.get('result') is not None:
-                break
-            else:
-                print(f"Empty result on attempt {attempt + 1}. Retrying in {retry_delay} second(s)...")
-                time.sleep(retry_delay)
-
-        except Exception as err:
-            env.add_reply(f"HTTP error occurred: {err}")
-            env.add_reply(f"Error details: {response.text}")
+            quote = await best_quote(token_data_in["defuse_asset_id"], token_data_out["defuse_asset_id"], int(amount))
+        except QuoteError as err:
+            env.add_reply(str(err))
             return None
 
-    else:
-        env.add_reply("Error: result is not provided")
-        return None
-
-    amount_out = 0
-
-    quote_hash = None
-    amount_in = None
-    expiration_time = None
-
-    if "result" in parsed_response and len(parsed_response["result"]) > 0:
-        for result in parsed_response["result"]:
-            # find a quote with the highest amount_out
-            if int(result["amount_out"]) > int(amount_out):
-                _asset_in = result["defuse_asset_identifier_in"]
-                _asset_out = result["defuse_asset_identifier_out"]
-                amount_in = result["amount_in"]
-                quote_hash = result["quote_hash"]
-                amount_out = result["amount_out"]
-                expiration_time = result["expiration_time"]
-            else:
-                this_amount_out = result["amount_out"]
-    else:
-        env.add_reply(f"Error: {response.status_code}, {response.text}")
-        return False
-
-    if not amount_in or not expiration_time or not quote_hash:
-        env.add_reply(f"Error with quote data: {response.status_code}, {response.text}")
-        return False
-
-    message_str = get_swap_message_to_sign(user_account_id, token_data_in["defuse_asset_id"], amount_in, token_data_out["defuse_asset_id"],
-                                           amount_out, expiration_time)
-    nonce = generate_nonce()
-
-    quote_hashes = [quote_hash]
-
-    nonce_uint8array = base64_to_uint8array(nonce)
-
-    quote_hash_solver = serialize_intent(message_str, INTENTS_CONTRACT, nonce_uint8array)
+        if quote is None:
+            env.add_reply("Error: no usable quote was provided before the deadline")
+            return None
 
-    private_key_base58 = user_private_key[len(ED_PREFIX):]
-    private_key_bytes = base58.b58decode(private_key_base58)
+        # A quote can back only one intent
+        quote_cache.discard(quote)
 
-    if len(private_key_bytes) != 64:
-        raise ValueError("The private key must be exactly 64 bytes long")
+        amount_in = quote["amount_in"]
+        quote_hash = quote["quote_hash"]
+        amount_out = quote["amount_out"]
+        expiration_time = quote["expiration_time"]
 
-    private_key_seed = private_key_bytes[:32]
-    signing_key = nacl.signing.SigningKey(private_key_seed)
-    public_key = signing_key.verify_key
-    signed = signing_key.sign(quote_hash_solver)
-    _signature = base64.b64encode(signed.signature).decode("utf-8")
+        message_str = get_swap_message_to_sign(user_account_id, token_data_in["defuse_asset_id"], amount_in, token_data_out["defuse_asset_id"],
+                                               amount_out, expiration_time)
 
-    final_signature = base58.b58encode(signed.signature).decode("utf-8")
+        quote_hashes = [quote_hash]
 
-    public_key_base58 = base58.b58encode(public_key.encode()).decode("utf-8")
-    _full_public_key = ED_PREFIX + public_key_base58
+        signer = get_signer(env)
+        signed_data = signer.sign(message_str, INTENTS_CONTRACT)
 
-    await add_public_key(env, _full_public_key)
+        if register_key:
+            await add_public_key(env, signer.public_key)
 
-    request = {
-        "id": 1,
-        "jsonrpc": "2.0",
-        "method": "publish_intent",
-        "params": [
-            {
-                "quote_hashes": quote_hashes,
-                "signed_data": {
-                    "payload": {
-                        "message": message_str,
-                        "nonce": nonce,
-                        "recipient": INTENTS_CONTRACT,
-                    },
-                    "standard": "nep413",
-                    "signature": f"ed25519:{final_signature}",
-                    "public_key": f"ed25519:{base58.b58encode(public_key.encode()).decode()}",
+        request = {
+            "id": 1,
+            "jsonrpc": "2.0",
+            "method": "publish_intent",
+            "params": [
+                {
+                    "quote_hashes": quote_hashes,
+                    "signed_data": signed_data
                 }
-            }
-        ]
-    }
+            ]
+        }
+
+        # Only a rejected publish is retried; a published intent is left to the
+        # settlement watcher, which keeps polling it with its own backoff.
+        for delay in PUBLISH_RETRY_DELAYS + (None,):
+            resp = await asyncio.to_thread(publish_intent, request)
+            if resp["result"]["status"] == "OK":
+                intent_hash = resp["result"]["intent_hash"]
+                break
+            # A rejected key is registered again before the next attempt
+            rejected_key = forget_rejected_key(env, signer.public_key, resp)
+            if delay is None:
+                break
+            if rejected_key:
+                await add_public_key(env, signer.public_key)
+            await asyncio.sleep(delay)
 
-    intent_response, settled, intent_hash, amount_in_usd, amount_out_usd, result = (
-        make_intent_swap(request, token_data_out["symbol"], amount_in, token_data_in["decimals"], amount_out, token_data_out["decimals"]))
+        if intent_hash and op is not None:
+            op.record("swap_intent", intent_hash=intent_hash, amount_in=amount_in, amount_out=amount_out)
+        if intent_hash:
+            emit("intent_published", intent_hash=intent_hash, kind="swap")
 
-    if not settled:
-        # Try again
-        time.sleep(2)
-        intent_response, settled, intent_hash, amount_in_usd, amount_out_usd, result = (
-            make_intent_swap(request, token_data_out["symbol"], amount_in, token_data_in["decimals"], amount_out, token_data_out["decimals"]))
+    settled, result = await settlement_watcher.wait(intent_hash) if intent_hash else (False, resp)
 
-        if not settled:
-            # Try again
-            time.sleep(10)
-            intent_response, settled, intent_hash, amount_in_usd, amount_out_usd, result = (
-                make_intent_swap(request, token_data_out["symbol"], amount_in, token_data_in["decimals"], amount_out, token_data_out["decimals"]))
+    if intent_hash:
+        balance_cache.invalidate(user_account_id)
 
     if settled:
         transaction_hash = result["result"]["data"]["hash"]
-        amount_out = Decimal(amount_out) / (Decimal(10) ** int(token_data_out["decimals"]))
-        amount_in = Decimal(amount_in) / (Decimal(10) ** int(token_data_in["decimals"]))
+        emit("intent_settled", intent_hash=intent_hash, transaction_hash=transaction_hash)
+        amount_out = token_data_out.from_units(amount_out)
+        amount_in = token_data_in.from_units(amount_in)
         env.add_reply(f"Transaction Hash: {transaction_hash}")
         return amount_out
 
     else:
+        emit("intent_failed", intent_hash=intent_hash)
         return False
 
-def make_intent_swap(request, symbol_out, amount_in, token_in_decimals, amount_out, token_out_decimals):
-
-    response = requests.post(url, headers=headers, json=request)
-    response.raise_for_status()
-    resp = response.json()
-
-    amount_in_usd = f"{float(amount_in) / pow(10, token_in_decimals):.5f}"
-    amount_out_usd = f"{float(amount_out) / pow(10, token_out_decimals):.5f}"
-
-    if resp["result"]["status"] == "OK":
-        intent_hash = resp["result"]["intent_hash"]
-
-        settled, result = get_intent_settled_status(intent_hash)
-
-        return resp, settled, intent_hash, amount_in_usd, amount_out_usd, result
+def _swap_tokens(token_in, token_out, token_data, contract_in = "", contract_out = ""):
+    token_data = registry_for(token_data)
+    matches_in = token_data.by_symbol(token_in)
+    matches_out = token_data.by_symbol(token_out)
+    if not matches_in or not matches_out:
+        return None, None
+
+    token_data_in = matches_in[0] if not contract_in else token_data.by_asset_id(contract_in)
+    token_data_out = matches_out[0] if not contract_out else token_data.by_asset_id(contract_out)
+    return token_data_in, token_data_out
+
+def preview_intent_swap(token_in, token_out, amount_in, token_data, contract_in = "", contract_out = ""):
+    """Estimated output of swapping `amount_in` from cached quotes only; None if nothing is cached."""
+    token_data_in, token_data_out = _swap_tokens(token_in, token_out, token_data, contract_in, contract_out)
+    if not token_data_in or not token_data_out:
+        return None
 
-    else:
-        return resp, False, False, amount_in_usd, amount_out_usd, resp
+    quote = preview_quote(token_data_in["defuse_asset_id"], token_data_out["defuse_asset_id"], token_data_in.to_units(amount_in))
+    if quote is None:
+        return None
+    return token_data_out.from_units(quote["amount_out"])
+
+async def quote_intent_swap_tiers(token_in, token_out, amounts_in, token_data, contract_in = "", contract_out = ""):
+    """Quote several amounts of `token_in` concurrently from the relay.
+
+    Returns `{amount_in: best amount_out or None}`. The quotes land in the
+    quote cache, so later previews and swaps of these amounts reuse them.
+    """
+    token_data_in, token_data_out = _swap_tokens(token_in, token_out, token_data, contract_in, contract_out)
+    if not token_data_in or not token_data_out:
+        return {amount_in: None for amount_in in amounts_in}
+
+    # Amounts that round to the same units share one quote request.
+    units = [token_data_in.to_units(amount_in) for amount_in in amounts_in]
+    tiers = await quote_tiers(token_data_in["defuse_asset_id"], token_data_out["defuse_asset_id"], list(dict.fromkeys(units)))
+    return {amount_in: token_data_out.from_units(tiers[amount][0]["amount_out"]) if tiers[amount] else None
+            for amount_in, amount in zip(amounts_in, units)}
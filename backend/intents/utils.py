@@ -1,23 +1,21 @@
 import json
 import time
-from decimal import Decimal
 
 import requests
 from nearai.agents.environment import Environment
 
 import base64
-import requests
 import hashlib
 import secrets
 from typing import Any, List, Optional, Union
 from serializer import BinarySerializer
 from borsh_construct import U32
+from balance_cache import TTLCache, balance_cache
+from intents.public_keys import get_public_key_registry
+from scheduler import get_scheduler
 
 default_mainnet_rpc = "https://rpc.mainnet.near.org"
 
-with open("tokens.json", "r") as file:
-    data = json.load(file)
-
 INTENTS_CONTRACT = "intents.near"
 url = "https://solver-relay-v2.chaindefuser.com/rpc"
 
@@ -25,6 +23,10 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# Keep-alive session shared by everything that talks to the solver relay.
+relay_session = requests.Session()
+relay_session.headers.update(headers)
+
 ED_PREFIX = "ed25519:"  
 
 FT_DEPOSIT_GAS = 30000000000000
@@ -36,69 +38,132 @@ async def add_public_key(env: Environment, public_key):
     # Setup
     user_account_id = env.env_vars.get("ACCOUNT_ID")
     user_private_key = env.env_vars.get("PRIVATE_KEY")
-    near = env.set_near(user_account_id, user_private_key)
 
-    has_public_key = await near.view(
-        "intents.near",
-        "has_public_key",
-        {
-            "account_id": user_account_id,
-            "public_key": str(public_key),
-        }
-    )
-
-    if has_public_key:
+    # Keys seen registered recently are trusted without another view call
+    public_keys = get_public_key_registry(env.env_vars)
+    if public_keys.is_registered(user_account_id, public_key):
         return
 
-    # Add the public_key
-    result = await near.call(
-        "intents.near",
-        "add_public_key",
-        {"public_key": str(public_key)},
-        FT_DEPOSIT_GAS,  # optional: you can specify gas
-        1  # 1 yoctoNEAR
-    )
-
-
-def get_intent_settled_status(intent_hash):
-    data = {
-        "id": 1,
-        "jsonrpc": "2.0",
-        "method": "get_status",
-        "params": [
+    # add_public_key is a transaction from the account's access key, so it
+    # takes the same lock as the account's other NEAR transactions.
+    async with get_scheduler(env).hold_async(("near", user_account_id)):
+        # Another caller may have registered it while we waited
+        if public_keys.is_registered(user_account_id, public_key):
+            return
+
+        near = env.set_near(user_account_id, user_private_key)
+
+        has_public_key = (await near.view(
+            "intents.near",
+            "has_public_key",
             {
-                "intent_hash": intent_hash
+                "account_id": user_account_id,
+                "public_key": str(public_key),
             }
-        ]
-    }
+        )).result
+
+        if has_public_key is True:
+            public_keys.mark_registered(user_account_id, public_key)
+            return
+
+        # Add the public_key
+        result = await near.call(
+            "intents.near",
+            "add_public_key",
+            {"public_key": str(public_key)},
+            FT_DEPOSIT_GAS,  # optional: you can specify gas
+            1  # 1 yoctoNEAR
+        )
+        if "SuccessValue" in result.status:
+            public_keys.mark_registered(user_account_id, public_key)
+
+
+# NEP-145 storage balances, keyed by (account, contract). Registration only goes
+# away through an explicit storage_unregister, and our own storage_deposit /
+# near_deposit calls invalidate what they touch.
+storage_cache = TTLCache(ttl=600)
+
+_UNCACHED = object()
+
+async def storage_balance_of(near, contract_id, account_id, fresh=False):
+    """`storage_balance_of(account_id)` on `contract_id`: `{"total", "available"}`, or None if unregistered."""
+    balance = _UNCACHED if fresh else storage_cache.get(account_id, contract_id, _UNCACHED)
+    if balance is _UNCACHED:
+        balance = (await near.view(
+            contract_id=contract_id,
+            method_name="storage_balance_of",
+            args={
+                "account_id": account_id
+            }
+        )).result or None
+        storage_cache.put(account_id, contract_id, balance)
+    return balance
+
+
+async def storage_deposit_needed(near, contract_id, account_id):
+    """Storage deposit (yoctoNEAR) `account_id` needs before it can hold `contract_id` tokens.
+
+    Under NEP-145 a registered account needs nothing more; an unregistered
+    one is charged the large minimum storage balance.
+    """
+    balance = await storage_balance_of(near, contract_id, account_id)
+    return 0 if balance is not None else FT_MINIMUM_STORAGE_BALANCE_LARGE
 
-    start_time = time.time()
-    status = "GOOD"
-    while True:
-        time.sleep(0.2)
 
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        response.raise_for_status()
-        resp = response.json()
+async def mt_batch_balance_of(near, account_id, token_ids, fresh=False):
+    """Intents balances of `account_id` for `token_ids`, as raw strings in order.
 
-        if resp['result']['status'] == "SETTLED":
-            return True, resp
+    Balances still in the balance cache are not fetched again; only the
+    missing ones go to the `mt_batch_balance_of` view. Pass `fresh=True` for
+    confirmation-critical checks that must see the chain.
+    """
+    hits = {} if fresh else balance_cache.get_many(account_id, token_ids)
+    missing = [token_id for token_id in dict.fromkeys(token_ids) if token_id not in hits]
 
-        elif (resp['result']['status'] == "NOT_FOUND_OR_NOT_VALID_ANYMORE"
-            or resp['result']['status'] == "NOT_FOUND_OR_NOT_VALID"):
-            print("Intent not found or not valid anymore")
-            return False, resp
-        
-        elif resp['result']['status'] == "FAILED":
-            return False, resp
+    if missing:
+        tr = await near.view(INTENTS_CONTRACT, "mt_batch_balance_of", {
+            "account_id": account_id,
+            "token_ids": missing,
+        })
+        fetched = dict(zip(missing, tr.result))
+        balance_cache.put_many(account_id, fetched)
+        hits.update(fetched)
 
-        elif time.time() - start_time > 30:
-            print("Timeout: Operation took longer than 30 seconds")
-            return False, resp
+    return [hits[token_id] for token_id in token_ids]
 
-        if status != resp['result']['status']:
-            status = resp['result']['status']
-        
+
+def publish_intent(request):
+    """POST a `publish_intent` request over the relay session; returns the JSON response."""
+    response = relay_session.post(url, json=request)
+    response.raise_for_status()
+    return response.json()
+
+
+# publish_intent failure reasons that mean intents.near does not accept the signing key
+KEY_REJECTION_MARKERS = ("signature", "public key", "public_key")
+
+
+def forget_rejected_key(env: Environment, public_key, resp):
+    """Drop the cached registration of `public_key` if `resp` rejected it.
+
+    Returns True when it did, so the next add_public_key checks on chain
+    (and registers the key again) instead of trusting the stale entry.
+    """
+    reason = str((resp.get("result") or {}).get("reason") or "").lower()
+    if not any(marker in reason for marker in KEY_REJECTION_MARKERS):
+        return False
+    get_public_key_registry(env.env_vars).forget(env.env_vars.get("ACCOUNT_ID"), public_key)
+    return True
+
+
+def get_intent_settled_status(intent_hash, timeout=None):
+    """Block until `intent_hash` is final; returns `(settled, response)`.
+
+    Thin facade over the shared SettlementWatcher, so concurrent callers
+    share one poller instead of each running their own loop.
+    """
+    from intents.settlement import settlement_watcher
+    return settlement_watcher.track(intent_hash).result(timeout)
 
 
 async def get_withdraw_message_to_sign(env: Environment, signer_id, token, receiver_id, amount, blockchain):
@@ -109,20 +174,12 @@ async def get_withdraw_message_to_sign(env: Environment, signer_id, token, recei
 
     near = env.set_near(user_account_id, user_private_key)
 
-    nep141balance = await near.view(
-        contract_id="wrap.near",
-        method_name="storage_balance_of",
-        args={
-            "account_id": user_account_id
-        }
-    )
-
-    if nep141balance.result:
-        nep141balance = int(nep141balance.result['available'])
-    else:
-        nep141balance = 0
-
-    storage_deposit = 0 if nep141balance > FT_MINIMUM_STORAGE_BALANCE_LARGE else FT_MINIMUM_STORAGE_BALANCE_LARGE
+    # The deposit pays for the receiving account's storage on the token
+    # contract; bridged tokens are withdrawn to the token contract itself.
+    storage_deposit = 0
+    if token != "wrap.near":
+        storage_account = receiver_id if blockchain == "near" else token
+        storage_deposit = await storage_deposit_needed(near, token, storage_account)
 
     message = "dummy"
 
@@ -257,12 +314,13 @@ PAYLOAD_SCHEMA: list[list[Any]] = [
     ]
 ]
 
+PAYLOAD_SCHEMA_DICT = dict(PAYLOAD_SCHEMA)
+NEP413_PREFIX = U32.build(2 ** 31 + 413)
+
 def serialize_intent(intent_message, recipient, nonce):
     payload2 = Payload(intent_message, nonce, recipient, None)
-    borsh_payload = BinarySerializer(dict(PAYLOAD_SCHEMA)).serialize(payload2)
+    borsh_payload = BinarySerializer(PAYLOAD_SCHEMA_DICT).serialize(payload2)
 
-    base_int = 2 ** 31 + 413
-    base_int_serialized = U32.build(base_int)
-    combined_data = base_int_serialized + borsh_payload
+    combined_data = NEP413_PREFIX + borsh_payload
     hash_result = hashlib.sha256(combined_data).digest()
     return hash_result
@@ -1,23 +1,20 @@
-import base64
-import json
-import time
+import asyncio
 from decimal import Decimal
 
-import base58
-import nacl.signing
-import requests
 from nearai.agents.environment import Environment
 
-from intents.utils import get_intent_settled_status, get_withdraw_message_to_sign, generate_nonce, base64_to_uint8array, serialize_intent
+from balance_cache import balance_cache
+from intents.consolidate import consolidate
+from intents.signer import get_signer
+from intents.settlement import settlement_watcher
+from intents.utils import forget_rejected_key, mt_batch_balance_of, get_withdraw_message_to_sign, publish_intent, storage_cache
 from intents.swap import _intent_swap
+from progress import emit
+from scheduler import get_scheduler
+from token_registry import registry_for
 
 default_mainnet_rpc = "https://rpc.mainnet.near.org"
 
-import re
-
-with open("tokens.json", "r") as file:
-    data = json.load(file)
-
 INTENTS_CONTRACT = "intents.near"
 url = "https://solver-relay-v2.chaindefuser.com/rpc"
 
@@ -32,116 +29,84 @@ FT_TRANSFER_GAS = 50000000000000
 FT_MINIMUM_STORAGE_BALANCE_LARGE = 1250000000000000000000
 
 
-async def withdraw_from_intents(env: Environment, token, amount, receiver_id, data, token_data=None):
+async def withdraw_from_intents(env: Environment, token, amount, receiver_id, data, token_data=None, op=None):
+    """Withdraw `amount` of `token` from intents to `receiver_id`.
+
+    Returns the settled withdrawal's transaction hash (falsy on failure).
+    With a journal `op`, the published intent_hash is recorded, and a resumed
+    operation waits for that intent instead of publishing a new one.
+    """
     
     user_account_id = env.env_vars.get("ACCOUNT_ID")
     user_private_key = env.env_vars.get("PRIVATE_KEY")
     near = env.set_near(user_account_id, user_private_key)
 
-    amount = int(Decimal(amount) * Decimal(10) ** int(token_data["decimals"]))
-
-    if amount < int(token_data["min_withdraw_amount"]):
-        env.add_reply(f"You need to withdraw at minimum {token_data['min_withdraw_amount']} {token} or else you may lose your money.")
-        return False
-
     contract_id = token_data["defuse_asset_id"].replace("nep141:", "")
 
-
-    token_list = [obj for obj in data if obj["symbol"] == token.upper()]
-    
-    if len(token_list) > 1:
-        contract_list = [obj["defuse_asset_id"] for obj in token_list]
-        tr = await near.view("intents.near", "mt_batch_balance_of",
+    if op is not None and op.get("withdraw_intent", "transaction_hash"):
+        return op.get("withdraw_intent", "transaction_hash")
+
+    # Withdrawals of one account run one at a time, so they cannot both be
+    # sized from the same intents balance.
+    async with get_scheduler(env).hold_async(("intents", user_account_id)):
+        intent_hash = op.get("withdraw_intent", "intent_hash") if op is not None else None
+        if intent_hash is None:
+            amount = token_data.to_units(amount)
+
+            if amount < int(token_data["min_withdraw_amount"]):
+                env.add_reply(f"You need to withdraw at minimum {token_data['min_withdraw_amount']} {token} or else you may lose your money.")
+                return False
+
+            token_list = registry_for(data).by_symbol(token)
+        
+            if len(token_list) > 1:
+                await consolidate(env, near, user_account_id, token_list, token_data, token_data.from_units(amount), _intent_swap, data)
+
+            near = env.set_near(user_account_id, user_private_key)
+            available = (await mt_batch_balance_of(near, user_account_id, [token_data["defuse_asset_id"]]))[0]
+            if Decimal(amount) > Decimal(available):
+                env.add_reply("Amount is more than the maximum available amount to withdraw. Withdrawing the complete amount")
+                amount = Decimal(available)
+        
+            message_str = await get_withdraw_message_to_sign(env, user_account_id, contract_id, receiver_id, amount, token_data["blockchain"])
+            signer = get_signer(env)
+            signed_data = signer.sign(message_str, INTENTS_CONTRACT)
+
+            request = {
+                "id": 1,
+                "jsonrpc": "2.0",
+                "method": "publish_intent",
+                "params": [
                     {
-                        "account_id": user_account_id,
-                        "token_ids": contract_list,
-                    })
-        result = tr.result
-        i = 0
-        j = contract_list.index(token_data["defuse_asset_id"])
-        result[j] = Decimal(result[j]) / (Decimal(10) ** int(token_data["decimals"]))
-
-        for i, token_obj in enumerate(token_list):
-            if i == j or Decimal(result[i]) == 0:
-                continue
-            result[i] = Decimal(result[i]) / (Decimal(10) ** int(token_obj["decimals"]))
-            if result[j] >= Decimal(amount):
-                break
-
-            amount_swapped = await _intent_swap(env, token_obj["symbol"], token_data["symbol"], result[i], data, token_obj["defuse_asset_id"], token_data["defuse_asset_id"])
-            
-            result[i] = 0
-            result[j] = result[j] + amount_swapped
-
-            i = i + 1
-            
-    near = env.set_near(user_account_id, user_private_key)
-    args = {
-        "account_id": user_account_id,
-        "token_ids": [token_data["defuse_asset_id"]],
-    }
-    
-    tr = await near.view("intents.near", "mt_batch_balance_of", args)
-    if Decimal(amount) > Decimal(tr.result[0]):
-        env.add_reply("Amount is more than the maximum available amount to withdraw. Withdrawing the complete amount")
-        amount = Decimal(tr.result[0])
-    
-    message_str = await get_withdraw_message_to_sign(env, user_account_id, contract_id, receiver_id, amount, token_data["blockchain"])
-    nonce = generate_nonce()
-    
-    nonce_uint8array = base64_to_uint8array(nonce)
-    quote_hash_solver = serialize_intent(message_str, INTENTS_CONTRACT, nonce_uint8array)
-
-    private_key_base58 = user_private_key[len(ED_PREFIX):]
-    private_key_bytes = base58.b58decode(private_key_base58)
-
-    if len(private_key_bytes) != 64:
-        raise ValueError("The private key must be exactly 64 bytes long")
-
-    private_key_seed = private_key_bytes[:32]
-    signing_key = nacl.signing.SigningKey(private_key_seed)
-    public_key = signing_key.verify_key
-    signed = signing_key.sign(quote_hash_solver)
-    
-    final_signature = base58.b58encode(signed.signature).decode("utf-8")
-    public_key_base58 = base58.b58encode(public_key.encode()).decode("utf-8")
-
-    request = {
-        "id": 1,
-        "jsonrpc": "2.0",
-        "method": "publish_intent",
-        "params": [
-            {
-                "quote_hashes": [],
-                "signed_data": {
-                    "payload": {
-                        "message": message_str,
-                        "nonce": nonce,
-                        "recipient": INTENTS_CONTRACT,
-                    },
-                    "standard": "nep413",
-                    "signature": f"ed25519:{final_signature}",
-                    "public_key": f"ed25519:{base58.b58encode(public_key.encode()).decode()}",
-                }
+                        "quote_hashes": [],
+                        "signed_data": signed_data
+                    }
+                ]
             }
-        ]
-    }
 
-    response = requests.post(url, headers=headers, json=request)
-    response.raise_for_status()
-    resp = response.json()
+            resp = await asyncio.to_thread(publish_intent, request)
 
-    if resp["result"]["status"] == "OK":
-        intent_hash = resp["result"]["intent_hash"]
+            if resp["result"]["status"] != "OK":
+                forget_rejected_key(env, signer.public_key, resp)
+                return None
 
-        settled, result = get_intent_settled_status(intent_hash)
+            intent_hash = resp["result"]["intent_hash"]
+            if op is not None:
+                op.record("withdraw_intent", intent_hash=intent_hash)
+            emit("intent_published", intent_hash=intent_hash, kind="withdraw")
+
+        settled, result = await settlement_watcher.wait(intent_hash)
+        balance_cache.invalidate(user_account_id)
+        # The withdrawal may have registered the receiver on the token contract
+        storage_cache.invalidate(asset=contract_id)
         if settled:
             transaction_hash = result["result"]["data"]["hash"]
+            if op is not None:
+                op.record("withdraw_intent", transaction_hash=transaction_hash)
+            emit("intent_settled", intent_hash=intent_hash, transaction_hash=transaction_hash)
             env.add_reply(f"Transaction Hash: {transaction_hash}")
-            return True
+            return transaction_hash
 
         else:
+            emit("intent_failed", intent_hash=intent_hash)
             return None
-
-    else:
-        return None
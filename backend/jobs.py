@@ -0,0 +1,253 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from progress import ProgressChannel, channel
+
+QUEUED = "queued"
+RUNNING = "running"
+# Stranded by a dead worker, waiting for its journaled operation to be resumed
+RESUMING = "resuming"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class MemoryJobStore:
+    """Job records of this process, as plain dicts."""
+    def __init__(self):
+        self._jobs = {}  # job id -> (job, last saved)
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = (dict(job), time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            return dict(entry[0]) if entry is not None else None
+
+    def find_operation(self, operation_id):
+        with self._lock:
+            return next((dict(job) for job, _ in self._jobs.values() if job.get("operation_id") == operation_id), None)
+
+    def renew(self, owner):
+        # Every job here belongs to this process, which is alive.
+        pass
+
+    def fail_stranded(self, before):
+        return []
+
+    def expire(self, before):
+        with self._lock:
+            for job_id, (job, saved) in list(self._jobs.items()):
+                if saved < before and job["status"] in FINISHED:
+                    del self._jobs[job_id]
+
+
+class SqliteJobStore:
+    """Job records in a local SQLite file, readable from every worker process.
+
+    `updated_at` doubles as the owning process's lease on its unfinished
+    jobs: the owner renews it, and a job whose lease ran out was stranded by
+    a process that died.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        return db
+
+    def save(self, job):
+        self._db().execute("INSERT OR REPLACE INTO jobs (id, job, updated_at) VALUES (?, ?, ?)",
+                           (job["id"], json.dumps(job, default=str), time.time()))
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_operation(self, operation_id):
+        row = self._db().execute("SELECT job FROM jobs WHERE json_extract(job, '$.operation_id') = ?", (operation_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def renew(self, owner):
+        self._db().execute("UPDATE jobs SET updated_at = ? WHERE json_extract(job, '$.owner') = ? "
+                           "AND json_extract(job, '$.status') IN (?, ?)", (time.time(), owner, QUEUED, RUNNING))
+
+    def fail_stranded(self, before):
+        """Mark unfinished jobs whose lease ran out before `before` as failed; returns their ids.
+
+        A job that started a journaled operation is marked `resuming`
+        instead; the server resumes the operation and finishes the job.
+        """
+        db = self._db()
+        rows = db.execute("SELECT id, job FROM jobs WHERE updated_at < ? AND json_extract(job, '$.status') IN (?, ?)",
+                          (before, QUEUED, RUNNING)).fetchall()
+        failed = []
+        for job_id, job in rows:
+            job = json.loads(job)
+            if job.get("operation_id"):
+                job.update(status=RESUMING, error="The worker running this job stopped; its operation will be resumed")
+            else:
+                job.update(status=FAILED, error="The worker running this job stopped before it finished", finished_at=time.time())
+            # Only if the owner has not renewed it meanwhile.
+            cursor = db.execute("UPDATE jobs SET job = ?, updated_at = ? WHERE id = ? AND updated_at < ?",
+                                (json.dumps(job, default=str), time.time(), job_id, before))
+            if cursor.rowcount:
+                failed.append(job_id)
+        return failed
+
+    def expire(self, before):
+        self._db().execute("DELETE FROM jobs WHERE updated_at < ? AND json_extract(job, '$.status') IN (?, ?)",
+                           (before, SUCCEEDED, FAILED))
+
+
+class JobQueue:
+    """Runs long wallet operations off the request path.
+
+    `submit` records a job and returns its id at once; a pool of
+    `max_workers` threads runs the jobs. At most `per_account` jobs of one
+    account run at a time. Later ones wait in a per-account FIFO without
+    holding a pool thread. Progress events a job emits are kept on its
+    record, which lives in `store` so any worker process can report it.
+
+    A maintenance thread renews this queue's lease on its unfinished jobs
+    every `lease / 3` seconds, marks jobs whose owner stopped renewing for
+    `lease` seconds as failed, and drops finished jobs after `ttl` seconds.
+    """
+    def __init__(self, store=None, max_workers=4, per_account=1, ttl=86400, lease=30):
+        self.store = store or MemoryJobStore()
+        self.per_account = per_account
+        self.ttl = ttl
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="job")
+        self._running = {}   # account -> running job count
+        self._waiting = {}   # account -> deque of (job, fn)
+        self._lock = threading.Lock()
+
+        threading.Thread(target=self._maintain, name="job-maintenance", daemon=True).start()
+
+    def submit(self, kind, fn, account=None, params=None):
+        """Queue `fn(**params)` as a `kind` job for `account`; returns the job record."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "account": account,
+            "params": params or {},
+            "owner": self.owner,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "events": [],
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self.store.save(job)
+
+        with self._lock:
+            if self._running.get(account, 0) < self.per_account:
+                self._running[account] = self._running.get(account, 0) + 1
+                self._pool.submit(self._run, job, fn)
+            else:
+                self._waiting.setdefault(account, deque()).append((job, fn))
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _maintain(self):
+        while True:
+            try:
+                now = time.time()
+                self.store.renew(self.owner)
+                self.store.fail_stranded(now - self.lease)
+                self.store.expire(now - self.ttl)
+            except Exception as e:
+                print(f"Job maintenance failed: {e}")
+            time.sleep(self.lease / 3)
+
+    def _run(self, job, fn):
+        job["status"] = RUNNING
+        job["started_at"] = time.time()
+        self.store.save(job)
+
+        try:
+            try:
+                with channel(_JobProgress(self, job)):
+                    result = fn(**job["params"])
+            except Exception as e:
+                result = e
+            self._finish(job, result)
+        finally:
+            self._next(job["account"])
+
+    def _finish(self, job, result):
+        # Wallet flows report most failures as a falsy result (or, for chat
+        # tools, "Error ..." text) rather than raising.
+        if isinstance(result, Exception):
+            job.update(status=FAILED, error=str(result))
+        elif not result or (isinstance(result, str) and result.startswith("Error")):
+            job.update(status=FAILED, result=result, error=result if isinstance(result, str) else f"{job['kind']} did not complete")
+        else:
+            job.update(status=SUCCEEDED, result=result, error=None)
+        job["finished_at"] = time.time()
+        self.store.save(job)
+
+    @contextmanager
+    def resuming(self, operation_id):
+        """Report a resumed journal operation on the job that started it.
+
+        For `journal.resume(..., track=...)`: the job is taken over by this
+        queue and runs again, its progress events are recorded, and the
+        yielded callable finishes it with the operation's result. Yields
+        None when no job started the operation.
+        """
+        job = self.store.find_operation(operation_id)
+        if job is None:
+            yield None
+            return
+        job.update(status=RUNNING, owner=self.owner, error=None)
+        self.store.save(job)
+        with channel(_JobProgress(self, job)):
+            yield lambda result: self._finish(job, result)
+
+    def _next(self, account):
+        with self._lock:
+            waiting = self._waiting.get(account)
+            if waiting:
+                self._pool.submit(self._run, *waiting.popleft())
+                return
+            self._waiting.pop(account, None)
+            self._running[account] -= 1
+            if not self._running[account]:
+                del self._running[account]
+
+
+class _JobProgress(ProgressChannel):
+    """Progress channel that appends each event to its job record."""
+    def __init__(self, queue, job):
+        super().__init__()
+        self.queue = queue
+        self.job = job
+
+    def put(self, event):
+        if event["event"] == "operation_started" and not self.job.get("operation_id"):
+            self.job["operation_id"] = event["operation_id"]
+        self.job["events"].append(event)
+        self.queue.store.save(self.job)
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from progress import emit
+
+DEFAULT_PATH = "operations.db"
+DEFAULT_LEASE = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation_id TEXT NOT NULL REFERENCES operations(id),
+    step TEXT NOT NULL,
+    data TEXT NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_operation ON steps(operation_id);
+"""
+
+# A random id per process: hostnames and PIDs repeat across container
+# restarts, so they cannot tell a dead owner from a live one.
+OWNER = uuid.uuid4().hex
+
+def _new_owner():
+    global OWNER
+    OWNER = uuid.uuid4().hex
+
+os.register_at_fork(after_in_child=_new_owner)
+
+
+class Operation:
+    """Handle on one journaled flow.
+
+    `steps` maps each step name to the data recorded for it last, so a
+    resumed flow can tell what it already sent (an opid, an intent_hash, a
+    withdrawal_hash, a txid) and poll for it instead of sending it again.
+    """
+    def __init__(self, journal, id, kind, params, steps):
+        self.journal = journal
+        self.id = id
+        self.kind = kind
+        self.params = params
+        self.steps = steps
+        self.status = None
+
+    def get(self, step, key=None, default=None):
+        data = self.steps.get(step)
+        if data is None:
+            return default
+        return data.get(key, default) if key else data
+
+    def record(self, step, **data):
+        self.steps[step] = {**self.steps.get(step, {}), **data}
+        self.journal._append(self.id, step, self.steps[step])
+
+    def finish(self, status="done"):
+        self.status = status
+        self.journal._set_status(self.id, status)
+
+
+class OperationJournal:
+    """Append-only SQLite journal of long-running deposit/swap/withdraw flows.
+
+    Each flow is an operation row owned by the process running it; every
+    state change is appended as a step row and never rewritten. The owner
+    holds a lease on its running operations, renewed every `lease / 3`
+    seconds by a heartbeat thread. Operations still `running` whose lease
+    has expired are the ones a crash interrupted, and `resume` picks them up.
+    """
+    def __init__(self, path=DEFAULT_PATH, lease=DEFAULT_LEASE):
+        self.path = path
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._heartbeat = None
+
+    def _start_heartbeat(self):
+        # Threads do not survive a fork, so this is checked on every begin/claim.
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._heartbeat = threading.Thread(target=self._renew_leases, name="journal-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                self._db.execute("UPDATE operations SET updated_at = ? WHERE owner = ? AND status = 'running'",
+                                 (time.time(), OWNER))
+
+    def begin(self, kind, **params) -> Operation:
+        op_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO operations (id, kind, params, status, owner, created_at, updated_at) VALUES (?, ?, ?, 'running', ?, ?, ?)",
+                (op_id, kind, json.dumps(params, default=str), OWNER, now, now))
+        self._start_heartbeat()
+        return Operation(self, op_id, kind, params, {})
+
+    def load(self, op_id) -> Operation:
+        with self._lock:
+            row = self._db.execute("SELECT kind, params FROM operations WHERE id = ?", (op_id,)).fetchone()
+            if row is None:
+                raise KeyError(op_id)
+            steps = {}
+            for step, data in self._db.execute("SELECT step, data FROM steps WHERE operation_id = ? ORDER BY seq", (op_id,)):
+                steps[step] = json.loads(data)
+        return Operation(self, op_id, row[0], json.loads(row[1]), steps)
+
+    def incomplete(self, kind=None):
+        """Operations that were started but never finished, oldest first."""
+        query = "SELECT id FROM operations WHERE status = 'running'"
+        args = ()
+        if kind is not None:
+            query += " AND kind = ?"
+            args = (kind,)
+        with self._lock:
+            op_ids = [row[0] for row in self._db.execute(query + " ORDER BY created_at", args)]
+        return [self.load(op_id) for op_id in op_ids]
+
+    def claim_orphans(self):
+        """Take over the running operations whose owner's lease has expired."""
+        expired = time.time() - self.lease
+        with self._lock:
+            rows = self._db.execute("SELECT id, owner FROM operations WHERE status = 'running' AND owner != ? AND updated_at < ? "
+                                    "ORDER BY created_at", (OWNER, expired)).fetchall()
+            claimed = []
+            for op_id, owner in rows:
+                # Compare-and-set, so two restarting workers cannot both take it.
+                cursor = self._db.execute("UPDATE operations SET owner = ?, updated_at = ? WHERE id = ? AND owner = ? AND updated_at < ?",
+                                          (OWNER, time.time(), op_id, owner, expired))
+                if cursor.rowcount:
+                    claimed.append(op_id)
+        if claimed:
+            self._start_heartbeat()
+        return [self.load(op_id) for op_id in claimed]
+
+    def lease_expiry(self):
+        """When the latest lease on another process's running operation expires, or None if there are none."""
+        with self._lock:
+            row = self._db.execute("SELECT MAX(updated_at) FROM operations WHERE status = 'running' AND owner != ?",
+                                   (OWNER,)).fetchone()
+        return row[0] + self.lease if row[0] is not None else None
+
+    def _append(self, op_id, step, data):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("INSERT INTO steps (operation_id, step, data, recorded_at) VALUES (?, ?, ?, ?)",
+                                 (op_id, step, json.dumps(data, default=str), now))
+                self._db.execute("UPDATE operations SET updated_at = ? WHERE id = ?", (now, op_id))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _set_status(self, op_id, status):
+        with self._lock:
+            self._db.execute("UPDATE operations SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), op_id))
+
+
+@contextmanager
+def operation(env, kind, op=None, **params):
+    """Journal one `kind` flow.
+
+    Without `op` a new operation is started. A given `op` of the same kind
+    (a resumed one) is continued; one of another kind belongs to an
+    enclosing flow and is only added to. The operation is finished by the
+    flow of its own kind: `failed` on an exception, otherwise `done` unless
+    the flow already called `op.finish("failed")` on a failed result.
+    """
+    if op is not None and op.kind != kind:
+        yield op
+        return
+
+    if op is None:
+        op = get_journal(env).begin(kind, **params)
+        emit("operation_started", operation_id=op.id, kind=kind)
+    try:
+        yield op
+    except Exception:
+        op.finish("failed")
+        raise
+    if op.status is None:
+        op.finish()
+
+
+_resumers = {}
+
+def resumer(kind):
+    """Register the coroutine function `fn(env, op)` that continues `kind` operations.
+
+    `fn` is expected to run the flow under `operation(env, kind, op)`.
+    """
+    def register(fn):
+        _resumers[kind] = fn
+        return fn
+    return register
+
+async def resume(env, journal=None, wait=True, track=None):
+    """Continue the operations a dead process left running, with their registered resumers.
+
+    A process that just died still holds its lease, so with `wait` the
+    operations of other owners are claimed again once the newest lease has
+    run out (at most `journal.lease` seconds); live owners keep renewing
+    theirs and are left alone. `track(op)`, if given, is a context manager
+    entered around each resumed flow; it yields a callable that is passed
+    the flow's result (or exception). Returns `{op_id: result or exception}`.
+    """
+    journal = journal or get_journal(env)
+    ops = journal.claim_orphans()
+    expiry = journal.lease_expiry() if wait else None
+    if expiry is not None and expiry > time.time():
+        print(f"Waiting up to {expiry - time.time():.0f}s for unfinished operations of other processes")
+        await asyncio.sleep(expiry - time.time())
+        ops += journal.claim_orphans()
+
+    results = {}
+    for op in ops:
+        fn = _resumers.get(op.kind)
+        if fn is None:
+            continue
+        print(f"Resuming {op.kind} operation {op.id}")
+        with track(op) if track else nullcontext() as report:
+            try:
+                results[op.id] = await fn(env, op)
+            except Exception as e:
+                print(f"Resuming {op.kind} operation {op.id} failed: {e}")
+                results[op.id] = e
+            if report:
+                report(results[op.id])
+    return results
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+def get_journal(env) -> OperationJournal:
+    """Return the journal for the OPERATION_JOURNAL configured in `env`."""
+    path = env.env_vars.get("OPERATION_JOURNAL", DEFAULT_PATH)
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            lease = float(env.env_vars.get("OPERATION_LEASE", DEFAULT_LEASE))
+            journal = _journals[path] = OperationJournal(path, lease)
+        return journal
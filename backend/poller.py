@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class BatchPoller:
+    """Base for trackers that poll many outstanding keys from one background thread.
+
+    `track(key)` registers a key and returns a Future shared by everyone
+    tracking it; the thread runs while any key is outstanding and exits
+    when none is left. Subclasses keep their per-key state in the dict
+    `_new_entry` returns, and implement `_tick`: poll what is due, call
+    `_resolve` for the keys that are final, and return how many seconds to
+    sleep before the next tick (a new `track` wakes the thread early).
+    """
+    name = "poller"
+
+    def __init__(self, error_interval=5.0):
+        self.error_interval = error_interval
+
+        self._entries = {}  # key -> {"future": Future, ...subclass state}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _new_entry(self, key):
+        return {}
+
+    def _on_track(self, key):
+        """Called with the lock held whenever `key` is tracked."""
+
+    def _callback_args(self, key, result):
+        return key, result
+
+    def track(self, key, callback=None) -> Future:
+        """Register `key` and return a Future for its final result.
+
+        `callback`, if given, is called with `_callback_args(key, result)`
+        once the key is final. Tracking the same key twice shares one
+        Future and one poll.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {"future": Future(), **self._new_entry(key)}
+            future = entry["future"]
+            self._on_track(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(*self._callback_args(key, f.result())))
+        return future
+
+    def subscribe(self, key, callback):
+        return self.track(key, callback)
+
+    async def wait(self, key, timeout=None):
+        """Await the final result for `key` from any event loop."""
+        # shield() keeps a timed-out waiter from cancelling the shared Future.
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.track(key))), timeout)
+
+    def pending(self):
+        with self._lock:
+            return list(self._entries)
+
+    def _resolve(self, resolved):
+        """Finish `[(key, result), ...]`. Call without holding the lock:
+        the futures' done-callbacks run here and may call `track`."""
+        with self._lock:
+            entries = [(self._entries.pop(key, None), result) for key, result in resolved]
+        for entry, result in entries:
+            if entry is not None and not entry["future"].done():
+                entry["future"].set_result(result)
+
+    def _tick(self):
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._entries:
+                        self._thread = None
+                        return
+
+                try:
+                    interval = self._tick()
+                except Exception as e:
+                    # A failed tick must not end polling for everyone waiting.
+                    print(f"{self.name} poll failed: {e}")
+                    interval = self.error_interval
+
+                self._wakeup.wait(max(interval, 0))
+                self._wakeup.clear()
+        finally:
+            # If the thread dies anyway, let the next track() start a new one.
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
@@ -0,0 +1,88 @@
+import threading
+import time
+from decimal import Decimal
+
+from token_registry import token_cache
+
+# Tokens that are shown to users under a different symbol.
+SYMBOL_ALIASES = {"WNEAR": "NEAR"}
+
+
+def display_symbol(token):
+    return SYMBOL_ALIASES.get(token["symbol"].upper(), token["symbol"])
+
+
+class PriceService:
+    """USD prices by defuse_asset_id, cached for `ttl` seconds.
+
+    Prices are read from the shared token list cache and turned into a
+    Decimal lookup table once per `ttl`, so valuing a balance is a dict
+    lookup and a multiply instead of a token list download.
+    """
+    def __init__(self, tokens=token_cache, ttl=30):
+        self.tokens = tokens
+        self.ttl = ttl
+
+        self._snapshot = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """Return the `(registry, prices)` pair the current prices were built from."""
+        with self._lock:
+            if self._snapshot is not None and time.time() - self._built_at <= self.ttl:
+                return self._snapshot
+
+        registry = self.tokens.get()
+        prices = {token["defuse_asset_id"]: Decimal(token.get("price") or 0) for token in registry}
+
+        with self._lock:
+            self._snapshot = (registry, prices)
+            self._built_at = time.time()
+            return self._snapshot
+
+    def price(self, defuse_asset_id):
+        return self.snapshot()[1].get(defuse_asset_id, Decimal(0))
+
+    def value(self, balances):
+        """Value a whole balance vector in one pass.
+
+        `balances` is an iterable of `(defuse_asset_id, base_units)` pairs.
+        Returns one holding per known asset, in order, with Decimal `amount`
+        and `usd`. Assets missing from the token list are skipped.
+        """
+        registry, prices = self.snapshot()
+        zero = Decimal(0)
+
+        holdings = []
+        for asset_id, units in balances:
+            token = registry.by_asset_id(asset_id)
+            if token is None:
+                continue
+            amount = Decimal(units) / token.scale
+            holdings.append({
+                "token": token,
+                "amount": amount,
+                "usd": amount * prices.get(asset_id, zero),
+            })
+        return holdings
+
+    def portfolio(self, balances):
+        """Value `balances` and group the non-zero holdings by display symbol.
+
+        Returns `{"holdings": [{"symbol", "amount", "usd"}, ...], "total_usd"}`.
+        """
+        grouped = {}
+        for holding in self.value(balances):
+            if holding["amount"] <= 0:
+                continue
+            symbol = display_symbol(holding["token"])
+            entry = grouped.setdefault(symbol, {"symbol": symbol, "amount": Decimal(0), "usd": Decimal(0)})
+            entry["amount"] += holding["amount"]
+            entry["usd"] += holding["usd"]
+
+        holdings = list(grouped.values())
+        return {"holdings": holdings, "total_usd": sum((h["usd"] for h in holdings), Decimal(0))}
+
+
+price_service = PriceService()
@@ -0,0 +1,46 @@
+import contextvars
+import queue
+import time
+from contextlib import contextmanager
+
+_channel = contextvars.ContextVar("progress_channel", default=None)
+
+
+class ProgressChannel:
+    """Queue of progress events for one client request.
+
+    Long-running flows call `emit(...)`; whoever opened the channel (e.g. a
+    streaming HTTP response) drains it with `get`. The channel is carried in
+    a context variable, so it follows the flow into `asyncio.to_thread` and
+    new tasks without being passed around explicitly.
+    """
+    def __init__(self):
+        self._events = queue.Queue()
+
+    def put(self, event):
+        self._events.put(event)
+
+    def get(self, timeout=None):
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+@contextmanager
+def channel(progress=None):
+    """Route the `emit` calls made inside the block (and its threads/tasks) to `progress`."""
+    progress = progress or ProgressChannel()
+    token = _channel.set(progress)
+    try:
+        yield progress
+    finally:
+        _channel.reset(token)
+
+
+def emit(event, **data):
+    """Report a progress event (opid_submitted, intent_published, ...) to the current channel, if any."""
+    progress = _channel.get()
+    if progress is not None:
+        progress.put({"event": event, "time": time.time(), **data})
@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; locks are then per process only
+    fcntl = None
+
+
+class AccountScheduler:
+    """Serializes state-changing operations per account.
+
+    Operations that spend from the same account (a Zcash account's note
+    pool, a NEAR account's access key nonce) take the lock for that
+    account's key, e.g. `("zcash", 3)` or `("near", "alice.near")`, so they
+    run one at a time. Operations on other accounts, and read-only views,
+    which take no lock, still run in parallel. With `lock_dir`, each key
+    is also guarded by an flock on a file in that directory, so the
+    guarantee holds across worker processes on the same host.
+    Locks are not re-entrant.
+
+    Coroutines first queue on a per-key asyncio.Lock of their loop, so only
+    one of them per key waits for the thread/file lock, and it does so on
+    the scheduler's own executor. The loop's default executor, which the
+    lock holders themselves use for blocking calls, is never tied up.
+    """
+    def __init__(self, lock_dir=None, max_waiters=32):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._loop_locks = weakref.WeakKeyDictionary()  # loop -> {key: asyncio.Lock}
+        self._waiters = ThreadPoolExecutor(max_waiters, thread_name_prefix="account-lock")
+
+    def _async_lock(self, key):
+        # Only touched from the loop's own thread, so no lock is needed.
+        locks = self._loop_locks.setdefault(asyncio.get_running_loop(), {})
+        lock = locks.get(key)
+        if lock is None:
+            lock = locks[key] = asyncio.Lock()
+        return lock
+
+    def _thread_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _acquire(self, key):
+        self._thread_lock(key).acquire()
+        if not self.lock_dir:
+            return None
+        try:
+            name = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+            file = open(os.path.join(self.lock_dir, f"{name}.lock"), "a")
+            fcntl.flock(file, fcntl.LOCK_EX)
+            return file
+        except BaseException:
+            self._thread_lock(key).release()
+            raise
+
+    def _release(self, key, file):
+        if file is not None:
+            fcntl.flock(file, fcntl.LOCK_UN)
+            file.close()
+        self._thread_lock(key).release()
+
+    @contextmanager
+    def hold(self, key):
+        """Run the block as the only operation holding `key`."""
+        file = self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key, file)
+
+    @asynccontextmanager
+    async def hold_async(self, key):
+        """`hold` for coroutines; waits for the lock without blocking the event loop."""
+        async with self._async_lock(key):
+            acquiring = asyncio.get_running_loop().run_in_executor(self._waiters, self._acquire, key)
+            try:
+                file = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # The lock may still be granted after we stopped waiting; give it back.
+                acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or self._release(key, f.result()))
+                raise
+            try:
+                yield
+            finally:
+                self._release(key, file)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(env) -> AccountScheduler:
+    """Return the scheduler for the ACCOUNT_LOCK_DIR configured in `env` (in-process locks if unset)."""
+    lock_dir = env.env_vars.get("ACCOUNT_LOCK_DIR")
+    with _schedulers_lock:
+        scheduler = _schedulers.get(lock_dir)
+        if scheduler is None:
+            scheduler = _schedulers[lock_dir] = AccountScheduler(lock_dir)
+        return scheduler
@@ -1,161 +1,310 @@
-class BinarySerializer:
+import struct
+import threading
 
-    def __init__(self, schema):
-        self.array = bytearray()
-        self.schema = schema
+_INT_STRUCTS = {
+    1: struct.Struct('<B'),
+    2: struct.Struct('<H'),
+    4: struct.Struct('<I'),
+    8: struct.Struct('<Q'),
+}
+_U32 = _INT_STRUCTS[4]
 
-    def read_bytes(self, n):
-        assert n + self.offset <= len(
-            self.array
-        ), f'n: {n} offset: {self.offset}, length: {len(self.array)}'
-        ret = self.array[self.offset:self.offset + n]
-        self.offset += n
-        return ret
+# Compiled (encode, decode) plans per struct type. The key includes the id of
+# the struct's schema entry, which is kept alive in the value so the id can't
+# be reused by another schema. Only complete plans are published here; plans
+# still being compiled live in _compiling, private to the thread holding
+# _plans_lock.
+_plans = {}
+_plans_lock = threading.RLock()
+_compiling = {}
 
-    def serialize_num(self, value, n_bytes):
-        assert value >= 0
-        for i in range(n_bytes):
-            self.array.append(value & 255)
-            value //= 256
-        assert value == 0
-
-    def deserialize_num(self, n_bytes):
-        value = 0
-        bytes_ = self.read_bytes(n_bytes)
-        for b in bytes_[::-1]:
-            value = value * 256 + b
-        return value
-
-    def serialize_field(self, value, fieldType):
-        if type(fieldType) == tuple:
-            if len(fieldType) == 0:
-                pass
-            else:
-                assert len(value) == len(fieldType)
-                for (v, t) in zip(value, fieldType):
-                    self.serialize_field(v, t)
-        elif type(fieldType) == str:
-            if fieldType == 'bool':
+
+def _int_codec(n_bytes):
+    packer = _INT_STRUCTS.get(n_bytes)
+    if packer is not None:
+        pack, unpack_from = packer.pack, packer.unpack_from
+
+        def encode(out, value):
+            assert value >= 0
+            out += pack(value)
+
+        def decode(view, offset):
+            return unpack_from(view, offset)[0], offset + n_bytes
+    else:
+        def encode(out, value):
+            assert value >= 0
+            out += value.to_bytes(n_bytes, 'little')
+
+        def decode(view, offset):
+            end = offset + n_bytes
+            assert end <= len(view), f'n: {n_bytes} offset: {offset}, length: {len(view)}'
+            return int.from_bytes(view[offset:end], 'little'), end
+    return encode, decode
+
+
+def _compile_field(schema, fieldType, zero_copy=False):
+    if type(fieldType) == tuple:
+        if len(fieldType) == 0:
+            return (lambda out, value: None), (lambda view, offset: (None, offset))
+        codecs = [_compile_field(schema, t, zero_copy) for t in fieldType]
+
+        def encode(out, value):
+            assert len(value) == len(codecs)
+            for v, (enc, _) in zip(value, codecs):
+                enc(out, v)
+
+        def decode(view, offset):
+            values = []
+            for _, dec in codecs:
+                value, offset = dec(view, offset)
+                values.append(value)
+            return tuple(values), offset
+        return encode, decode
+
+    elif type(fieldType) == str:
+        if fieldType == 'bool':
+            def encode(out, value):
                 assert isinstance(value, bool), str(type(value))
-                self.serialize_num(int(value), 1)
-            elif fieldType[0] == 'u':
-                self.serialize_num(value, int(fieldType[1:]) // 8)
-            elif fieldType == 'string':
+                out.append(int(value))
+
+            def decode(view, offset):
+                value = view[offset]
+                assert 0 <= value <= 1, f"Fail to deserialize bool: {value}"
+                return bool(value), offset + 1
+            return encode, decode
+        elif fieldType[0] == 'u':
+            return _int_codec(int(fieldType[1:]) // 8)
+        elif fieldType == 'string':
+            def encode(out, value):
                 b = value.encode('utf8')
-                self.serialize_num(len(b), 4)
-                self.array += b
-            else:
-                assert False, fieldType
-        elif type(fieldType) == list:
-            assert len(fieldType) == 1
-            if type(fieldType[0]) == int:
+                out += _U32.pack(len(b))
+                out += b
+
+            def decode(view, offset):
+                len_ = _U32.unpack_from(view, offset)[0]
+                start = offset + 4
+                end = start + len_
+                assert end <= len(view), f'n: {len_} offset: {start}, length: {len(view)}'
+                if zero_copy:
+                    return view[start:end], end
+                return str(view[start:end], 'utf8'), end
+            return encode, decode
+        else:
+            assert False, fieldType
+
+    elif type(fieldType) == list:
+        assert len(fieldType) == 1
+        if type(fieldType[0]) == int:
+            size = fieldType[0]
+
+            def encode(out, value):
                 assert type(value) == bytes
-                assert len(value) == fieldType[0], "len(%s) = %s != %s" % (
-                    value, len(value), fieldType[0])
-                self.array += bytearray(value)
-            else:
-                self.serialize_num(len(value), 4)
+                assert len(value) == size, "len(%s) = %s != %s" % (value, len(value), size)
+                out += value
+
+            def decode(view, offset):
+                end = offset + size
+                assert end <= len(view), f'n: {size} offset: {offset}, length: {len(view)}'
+                if zero_copy:
+                    return view[offset:end], end
+                return bytes(view[offset:end]), end
+            return encode, decode
+        else:
+            enc_el, dec_el = _compile_field(schema, fieldType[0], zero_copy)
+
+            def encode(out, value):
+                out += _U32.pack(len(value))
                 for el in value:
-                    self.serialize_field(el, fieldType[0])
-        elif type(fieldType) == dict:
-            assert fieldType['kind'] == 'option'
+                    enc_el(out, el)
+
+            def decode(view, offset):
+                len_ = _U32.unpack_from(view, offset)[0]
+                offset += 4
+                values = []
+                for _ in range(len_):
+                    value, offset = dec_el(view, offset)
+                    values.append(value)
+                return values, offset
+            return encode, decode
+
+    elif type(fieldType) == dict:
+        assert fieldType['kind'] == 'option'
+        enc_inner, dec_inner = _compile_field(schema, fieldType['type'], zero_copy)
+
+        def encode(out, value):
             if value is None:
-                self.serialize_num(0, 1)
+                out.append(0)
             else:
-                self.serialize_num(1, 1)
-                self.serialize_field(value, fieldType['type'])
-        elif type(fieldType) == type:
-            assert type(value) == fieldType, "%s != type(%s)" % (fieldType,
-                                                                 value)
-            self.serialize_struct(value)
-        else:
-            assert False, type(fieldType)
+                out.append(1)
+                enc_inner(out, value)
 
-    def deserialize_field(self, fieldType):
-        if type(fieldType) == tuple:
-            if len(fieldType) == 0:
-                return None
-            else:
-                return tuple(self.deserialize_field(t) for t in fieldType)
+        def decode(view, offset):
+            if view[offset] == 0:
+                return None, offset + 1
+            return dec_inner(view, offset + 1)
+        return encode, decode
 
-        elif type(fieldType) == str:
-            if fieldType == 'bool':
-                value = self.deserialize_num(1)
-                assert 0 <= value <= 1, f"Fail to deserialize bool: {value}"
-                return bool(value)
-            elif fieldType[0] == 'u':
-                return self.deserialize_num(int(fieldType[1:]) // 8)
-            elif fieldType == 'string':
-                len_ = self.deserialize_num(4)
-                return self.read_bytes(len_).decode('utf8')
-            else:
-                assert False, fieldType
-        elif type(fieldType) == list:
-            assert len(fieldType) == 1
-            if type(fieldType[0]) == int:
-                return bytes(self.read_bytes(fieldType[0]))
-            else:
-                len_ = self.deserialize_num(4)
-                return [
-                    self.deserialize_field(fieldType[0]) for _ in range(len_)
-                ]
-        elif type(fieldType) == dict:
-            assert fieldType['kind'] == 'option'
-            is_none = self.deserialize_num(1) == 0
-            if is_none:
-                return None
-            else:
-                return self.deserialize_field(fieldType['type'])
-        elif type(fieldType) == type:
-            return self.deserialize_struct(fieldType)
-        else:
-            assert False, type(fieldType)
-
-    def serialize_struct(self, obj):
-        structSchema = self.schema[type(obj)]
-        if structSchema['kind'] == 'struct':
-            for fieldName, fieldType in structSchema['fields']:
-                self.serialize_field(getattr(obj, fieldName), fieldType)
-        elif structSchema['kind'] == 'enum':
-            name = getattr(obj, structSchema['field'])
-            for idx, (fieldName,
-                      fieldType) in enumerate(structSchema['values']):
-                if fieldName == name:
-                    self.serialize_num(idx, 1)
-                    self.serialize_field(getattr(obj, fieldName), fieldType)
-                    break
-            else:
-                assert False, name
-        else:
-            assert False, structSchema
+    elif type(fieldType) == type:
+        return _compile_struct(schema, fieldType, zero_copy)
+    else:
+        assert False, type(fieldType)
+
+
+def _compile_struct(schema, type_, zero_copy=False):
+    structSchema = schema[type_]
+    key = (type_, id(structSchema), zero_copy)
+    plan = _plans.get(key)
+    if plan is not None:
+        return plan[1]
+
+    with _plans_lock:
+        plan = _plans.get(key) or _compiling.get(key)
+        if plan is not None:
+            return plan[1]
+        outermost = not _compiling
+        try:
+            # Register a forwarding codec first so self-referencing types compile.
+            codec = []
+            _compiling[key] = (structSchema, (lambda out, value: codec[0](out, value), lambda view, offset: codec[1](view, offset)))
+            codec.extend(_build_struct(schema, type_, structSchema, zero_copy))
+            _compiling[key] = (structSchema, tuple(codec))
+            if outermost:
+                # Publish together: plans compiled meanwhile may forward to each other.
+                _plans.update(_compiling)
+        finally:
+            if outermost:
+                _compiling.clear()
+    return tuple(codec)
+
+
+def _build_struct(schema, type_, structSchema, zero_copy):
+    if structSchema['kind'] == 'struct':
+        fields = [(name, *_compile_field(schema, t, zero_copy)) for name, t in structSchema['fields']]
 
-    def deserialize_struct(self, type_):
-        structSchema = self.schema[type_]
-        if structSchema['kind'] == 'struct':
+        def encode(out, obj):
+            assert type(obj) == type_, "%s != type(%s)" % (type_, obj)
+            for name, enc, _ in fields:
+                enc(out, getattr(obj, name))
+
+        def decode(view, offset):
             ret = type_()
-            for fieldName, fieldType in structSchema['fields']:
-                setattr(ret, fieldName, self.deserialize_field(fieldType))
-            return ret
-        elif structSchema['kind'] == 'enum':
+            for name, _, dec in fields:
+                value, offset = dec(view, offset)
+                setattr(ret, name, value)
+            return ret, offset
+    elif structSchema['kind'] == 'enum':
+        variant_field = structSchema['field']
+        variants = [(name, *_compile_field(schema, t, zero_copy)) for name, t in structSchema['values']]
+        indexes = {name: idx for idx, (name, _, _) in enumerate(variants)}
+
+        def encode(out, obj):
+            assert type(obj) == type_, "%s != type(%s)" % (type_, obj)
+            name = getattr(obj, variant_field)
+            assert name in indexes, name
+            idx = indexes[name]
+            out.append(idx)
+            variants[idx][1](out, getattr(obj, name))
+
+        def decode(view, offset):
             ret = type_()
-            value_ord = self.deserialize_num(1)
-            value_schema = structSchema['values'][value_ord]
-            setattr(ret, structSchema['field'], value_schema[0])
-            setattr(ret, value_schema[0],
-                    self.deserialize_field(value_schema[1]))
+            name, _, dec = variants[view[offset]]
+            setattr(ret, variant_field, name)
+            value, offset = dec(view, offset + 1)
+            setattr(ret, name, value)
+            return ret, offset
+    else:
+        assert False, structSchema
+    return encode, decode
+
+
+def compile_schema(schema, fieldType, zero_copy=False):
+    """Return the precompiled `(encode, decode)` pair for `fieldType`.
+
+    `encode(out, value)` appends to the bytearray `out`; `decode(view,
+    offset)` reads from any bytes-like object and returns `(value,
+    new_offset)`. Plans for struct types are cached per type.
+
+    With `zero_copy`, fixed-size byte arrays and strings decode to
+    memoryview slices of the input instead of copies; strings stay
+    undecoded until the caller does `str(value, 'utf8')`. Pass a memoryview
+    as `view` for the slices to share its memory.
+    """
+    return _compile_field(schema, fieldType, zero_copy)
 
-            return ret
-        else:
-            assert False, structSchema
+
+_INCOMPLETE = (struct.error, IndexError, AssertionError)
+
+# Largest record iter_deserialize buffers from a stream, so a corrupt length
+# prefix fails fast instead of reading the whole stream into memory.
+MAX_RECORD_SIZE = 16 << 20
+
+
+def _iter_stream(decode, stream, chunk_size, max_record_size):
+    data = b''
+    offset = 0
+    position = 0  # stream position of data[0]
+    eof = False
+    while True:
+        if offset < len(data):
+            try:
+                value, end = decode(memoryview(data), offset)
+            except _INCOMPLETE:
+                if eof:
+                    raise ValueError(f"Truncated or invalid record at stream offset {position + offset}")
+                if len(data) - offset > max_record_size:
+                    raise ValueError(f"Record at stream offset {position + offset} exceeds {max_record_size} bytes")
+            else:
+                yield value
+                offset = end
+                continue
+        elif eof:
+            return
+
+        # Read at least as much as is already buffered, so a record larger
+        # than chunk_size is retried a logarithmic number of times.
+        chunk = stream.read(max(chunk_size, len(data) - offset))
+        eof = not chunk
+        data = data[offset:] + chunk
+        position += offset
+        offset = 0
+
+
+class BinarySerializer:
+
+    def __init__(self, schema):
+        self.array = bytearray()
+        self.schema = schema
 
     def serialize(self, obj):
-        self.serialize_struct(obj)
+        encode, _ = _compile_struct(self.schema, type(obj))
+        encode(self.array, obj)
         return bytes(self.array)
 
-    def deserialize(self, bytes_, type_):
-        self.array = bytearray(bytes_)
-        self.offset = 0
-        ret = self.deserialize_field(type_)
-        assert self.offset == len(bytes_), "%s != %s" % (self.offset,
-                                                         len(bytes_))
-        return ret
\ No newline at end of file
+    def deserialize(self, bytes_, type_, zero_copy=False):
+        _, decode = compile_schema(self.schema, type_, zero_copy)
+        ret, offset = decode(memoryview(bytes_) if zero_copy else bytes_, 0)
+        assert offset == len(bytes_), "%s != %s" % (offset, len(bytes_))
+        return ret
+
+    def iter_deserialize(self, source, type_, zero_copy=False, chunk_size=1 << 16, max_record_size=MAX_RECORD_SIZE):
+        """Yield consecutive `type_` records from a bytes-like object or binary file.
+
+        A buffer is decoded in place; a file is read `chunk_size` bytes at a
+        time, so only the records in flight are held in memory, and a record
+        over `max_record_size` bytes is rejected. A truncated or invalid
+        record raises ValueError with its offset either way.
+        """
+        _, decode = compile_schema(self.schema, type_, zero_copy)
+        if hasattr(source, 'read'):
+            yield from _iter_stream(decode, source, chunk_size, max_record_size)
+            return
+
+        view = memoryview(source)
+        offset = 0
+        while offset < len(view):
+            try:
+                ret, end = decode(view, offset)
+            except _INCOMPLETE:
+                raise ValueError(f"Truncated or invalid record at offset {offset}")
+            yield ret
+            offset = end
\ No newline at end of file
@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from collections.abc import Mapping
+from decimal import Decimal
+
+import requests
+
+TOKENS_API_URL = "https://api-mng-console.chaindefuser.com/api/tokens"
+
+
+class TokenRecord(Mapping):
+    """Read-only token entry.
+
+    Reads like the tokens.json dict it was built from (`token["symbol"]`,
+    `token.get("price")`), and carries the precomputed `scale`
+    (10 ** decimals) used to convert between base units and token amounts.
+    """
+    __slots__ = ("_fields", "scale")
+
+    def __init__(self, fields):
+        object.__setattr__(self, "_fields", dict(fields))
+        object.__setattr__(self, "scale", Decimal(10) ** int(self._fields["decimals"]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TokenRecord is immutable")
+
+    def __getitem__(self, key):
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(self._fields)
+
+    def to_units(self, amount):
+        """Token amount -> integer base units."""
+        return int(Decimal(amount) * self.scale)
+
+    def from_units(self, units):
+        """Integer base units -> Decimal token amount."""
+        return Decimal(units) / self.scale
+
+
+class TokenRegistry:
+    """Immutable token list with prebuilt lookup indexes.
+
+    Iterating a registry yields its TokenRecords in file order, so it can be
+    passed anywhere a tokens.json list was expected. Symbol lookups are
+    case-insensitive; every other lookup is exact.
+    """
+    def __init__(self, items):
+        self.tokens = tuple(item if isinstance(item, TokenRecord) else TokenRecord(item) for item in items)
+
+        by_symbol = {}
+        self._by_asset_id = {}
+        self._by_contract = {}
+        self._by_symbol_chain = {}
+        for token in self.tokens:
+            symbol = token["symbol"].upper()
+            by_symbol.setdefault(symbol, []).append(token)
+            self._by_asset_id.setdefault(token["defuse_asset_id"], token)
+            if token.get("contract_address"):
+                self._by_contract.setdefault(token["contract_address"], token)
+            self._by_symbol_chain.setdefault((symbol, token["blockchain"]), token)
+        self._by_symbol = {symbol: tuple(tokens) for symbol, tokens in by_symbol.items()}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as file:
+            return cls(json.load(file))
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, index):
+        return self.tokens[index]
+
+    def by_symbol(self, symbol):
+        """All tokens with this symbol, one per chain (empty tuple if unknown)."""
+        return self._by_symbol.get(symbol.upper(), ())
+
+    def by_asset_id(self, defuse_asset_id):
+        return self._by_asset_id.get(defuse_asset_id)
+
+    def by_contract(self, contract_address):
+        return self._by_contract.get(contract_address)
+
+    def by_symbol_chain(self, symbol, blockchain):
+        return self._by_symbol_chain.get((symbol.upper(), blockchain))
+
+
+def registry_for(tokens):
+    """Return `tokens` as a TokenRegistry, indexing it if it is a plain list."""
+    if isinstance(tokens, TokenRegistry):
+        return tokens
+    return TokenRegistry(tokens)
+
+
+class TokenListCache:
+    """The remote token list (with prices), cached with stale-while-revalidate.
+
+    A value younger than `ttl` is served as-is. An older value is still
+    served immediately while a background thread fetches a new one, so
+    readers only wait on the API for the very first load. A background
+    refresher re-fetches every `refresh_interval` seconds once the cache is
+    in use. If the API cannot be reached and nothing was cached yet, the
+    `fallback` registry (the bundled tokens.json) is served instead.
+    """
+    def __init__(self, url=TOKENS_API_URL, ttl=60, refresh_interval=30, timeout=2, fallback=None):
+        self.url = url
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.fallback = fallback
+
+        self.metrics = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "failures": 0, "fallbacks": 0}
+        self._value = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refresher = None
+
+    def _fetch(self):
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        items = response.json().get("items")
+        if items is None:
+            raise ValueError("Token list response has no items")
+        return TokenRegistry(items)
+
+    def refresh(self):
+        """Fetch the list now; returns False (keeping the old value) on failure."""
+        try:
+            value = self._fetch()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            with self._lock:
+                self.metrics["failures"] += 1
+            print(f"Token list refresh failed: {e}")
+            return False
+
+        with self._lock:
+            self._value = value
+            self._fetched_at = time.time()
+            self.metrics["refreshes"] += 1
+        return True
+
+    def _revalidate(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+    def _start_background(self, stale):
+        # Called with the lock held.
+        if self.refresh_interval and self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-list-refresher", daemon=True)
+            self._refresher.start()
+        if stale and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._revalidate, name="token-list-revalidate", daemon=True).start()
+
+    def get(self) -> TokenRegistry:
+        with self._lock:
+            value = self._value
+            if value is not None:
+                stale = time.time() - self._fetched_at > self.ttl
+                self.metrics["stale_hits" if stale else "hits"] += 1
+                self._start_background(stale)
+                return value
+            self.metrics["misses"] += 1
+
+        if self.refresh():
+            with self._lock:
+                self._start_background(False)
+                return self._value
+
+        # Serve the fallback as an already-stale value, so later readers get it
+        # immediately and trigger a background retry instead of blocking.
+        with self._lock:
+            self.metrics["fallbacks"] += 1
+            if self._value is None and self.fallback is not None:
+                self._value = self.fallback
+                self._fetched_at = 0
+            return self.fallback
+
+
+# The bundled token list, parsed once per process.
+registry = TokenRegistry.load("tokens.json")
+
+# The live token list with prices, shared by every balance query.
+token_cache = TokenListCache(fallback=registry)
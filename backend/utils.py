@@ -1,3 +1,4 @@
+import asyncio
 import json
 import re
 import base64
@@ -9,14 +10,14 @@ from rich.markdown import Markdown
 from io import StringIO
 
 import zcash
+from intents.utils import mt_batch_balance_of
+from prices import display_symbol, price_service
+from token_registry import registry
 
 NEAR_BUFFER = 25000000000000000000000
 
-with open("tokens.json", "r") as file:
-    data = json.load(file)
-    meta_data = data
-    for token in meta_data:
-        token['min_withdraw_amount'] = Decimal(token['min_withdraw_amount']) / (Decimal(10) ** token['decimals'])
+data = registry
+meta_data = [dict(token, min_withdraw_amount=token.from_units(token['min_withdraw_amount'])) for token in registry]
 
 main_prompt = f""" 
 You are a DeFi bot assistant for managing NEAR and Zcash transactions.
@@ -68,76 +69,108 @@ def reply_with_markdown(env: Environment, data, prompt):
     except Exception as e:
         print(f"Error adding to log: {e}")
 
+# Per-source time budget (seconds) for the wallet balance fan-out.
+WALLET_SOURCE_TIMEOUTS = {
+    "fastnear": 5,
+    "nearblocks": 5,
+    "zcash": 10,
+}
+
+async def _gather_sources(sources, timeouts):
+    """Run independent blocking fetches concurrently, each under its own timeout.
+
+    `sources` maps a name to a zero-argument callable. Returns `(results,
+    errors)`, two dicts keyed by source name, so one slow or failing backend
+    only loses its own part of the answer.
+    """
+    async def run(name, fetch):
+        return await asyncio.wait_for(asyncio.to_thread(fetch), timeouts.get(name))
+
+    outcomes = await asyncio.gather(*(run(name, fetch) for name, fetch in sources.items()), return_exceptions=True)
+
+    results = {}
+    errors = {}
+    for name, outcome in zip(sources, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            errors[name] = f"timed out after {timeouts.get(name)}s"
+        elif isinstance(outcome, Exception):
+            errors[name] = str(outcome)
+        else:
+            results[name] = outcome
+    return results, errors
+
+def _fetch_json(url, timeout):
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()  # Raise an exception for bad status codes
+    return response.json()
+
+def _zcash_address_balance(env: Environment, address):
+    account = zcash.getAccountForAddress(env, address)
+    if account is None:
+        raise ValueError(f"No wallet account found for {address}")
+    return zcash.account_balance(env, account)
+
 async def _wallet_balance(env: Environment, account_id, data_old):
-    data = (load_url("https://api-mng-console.chaindefuser.com/api/tokens"))
-    if data["items"] is None:
-        data = data_old
-    else:   
-        data = data["items"]
+    data, _ = await asyncio.to_thread(price_service.snapshot)
+    timeouts = WALLET_SOURCE_TIMEOUTS
 
     try:
-        # Fetch tokens (excluding NEAR)
-        token_response = requests.get(f"https://api.fastnear.com/v1/account/{account_id}/ft")
-        token_response.raise_for_status()  # Raise an exception for bad status codes
-
-        
-        # Fetch NEAR balance
-        near_response = requests.get(f"https://api.nearblocks.io/v1/account/{account_id}")
-        near_response.raise_for_status()  # Raise an exception for bad status codes
+        # Fetch tokens (excluding NEAR), the NEAR balance and the Zcash balance concurrently
+        results, errors = await _gather_sources({
+            "fastnear": lambda: _fetch_json(f"https://api.fastnear.com/v1/account/{account_id}/ft", timeouts["fastnear"]),
+            "nearblocks": lambda: _fetch_json(f"https://api.nearblocks.io/v1/account/{account_id}", timeouts["nearblocks"]),
+            "zcash": lambda: _zcash_address_balance(env, env.env_vars.get("ZCASH_ADDRESS")),
+        }, timeouts)
         
-        tokens = token_response.json().get("tokens", [])
-        near_balance = near_response.json().get("account", [{}])[0].get("amount", "0")
+        tokens = results.get("fastnear", {}).get("tokens", [])
+        near_balance = results.get("nearblocks", {}).get("account", [{}])[0].get("amount", "0")
         
-        # Process token balances
-        token_balances = []
+        # Collect the raw balances, then value them all at once
+        balances = []
         for token in tokens:
             
-            entry = [item for item in data if item.get('contract_address') == token["contract_id"]]
+            entry = data.by_contract(token["contract_id"])
 
-            if (len(entry) == 0):
+            if entry is None:
                 continue
 
-            balance = (
-                str(((Decimal(token["balance"]) + Decimal(near_balance) - Decimal(NEAR_BUFFER)) / Decimal(Decimal(10) ** int(entry[0]["decimals"]))))
+            units = (
+                Decimal(token["balance"]) + Decimal(near_balance) - Decimal(NEAR_BUFFER)
                 if token["contract_id"] == "wrap.near"
-                else str((Decimal(token["balance"]) / Decimal(Decimal(10) ** int(entry[0]["decimals"]))))
+                else Decimal(token["balance"])
             )
-            
-            if Decimal(balance) < 0:
-                balance = "0"
+            balances.append((entry["defuse_asset_id"], units))
+        
+        entry = data.by_symbol("ZEC")
 
-            balance_usd = str((Decimal(entry[0]["price"]) * Decimal(balance)))
-            
-            if entry[0]["symbol"].upper() == "WNEAR":
-                    entry[0]["symbol"] = "NEAR"
+        zec_holding = None
+        if "zcash" in results:
+            transparent_balance, shielded_balance = results["zcash"]
+            zec_balance = Decimal(transparent_balance) + Decimal(shielded_balance) - Decimal("0.0004")
+            if zec_balance < 0:
+                zec_balance = 0
+            zec_holding = (entry[0]["defuse_asset_id"], Decimal(zec_balance) * entry[0].scale)
+            balances.append(zec_holding)
+
+        token_balances = []
+        for holding in price_service.value(balances):
+            token = holding["token"]
+            is_zec = zec_holding is not None and token["defuse_asset_id"] == zec_holding[0]
             
-            if Decimal(balance) <= 0:
+            if holding["amount"] <= 0 and not is_zec:
                 continue
             
             token_balances.append({
-                "contractId": entry[0]["defuse_asset_id"].replace("nep141:", ""),
-                "symbol": entry[0]["symbol"],
-                "blockchain": entry[0]["blockchain"],
-                "balance": balance,
-                "balance_usd": balance_usd
+                "contractId": token["defuse_asset_id"].replace("nep141:", ""),
+                "symbol": display_symbol(token),
+                "blockchain": token["blockchain"],
+                "balance": str(holding["amount"]),
+                "balance_usd": str(holding["usd"])
             })
-        
-        entry = [item for item in data if item.get('symbol') == "ZEC"]
 
-        account = zcash.getAccountForAddress(env, env.env_vars.get("ZCASH_ADDRESS"))
-        transparent_balance, shielded_balance = zcash.account_balance(env, account)
-        zec_balance = Decimal(transparent_balance) + Decimal(shielded_balance) - Decimal("0.0004")
-        if zec_balance < 0:
-            zec_balance = 0
-        
-        balance_usd = str((Decimal(entry[0]["price"]) * Decimal(zec_balance)))
-        token_balances.append({
-                "contractId": entry[0]["defuse_asset_id"].replace("nep141:", ""),
-                "symbol": f"{entry[0]['symbol']}",
-                "blockchain": entry[0]["blockchain"],
-                "balance": str(zec_balance),
-                "balance_usd": balance_usd
-            })
+        # Keep whatever did arrive, and say which sources are missing
+        for source, error in errors.items():
+            token_balances.append({"source": source, "error": error})
 
         if len(token_balances) == 0:
             return "You have no tokens in your wallet."
@@ -145,56 +178,26 @@ async def _wallet_balance(env: Environment, account_id, data_old):
         
         return json.dumps(token_balances)
     
-    except requests.RequestException as e:
-        raise Exception(f"Request failed: {e}")
     except Exception as e:
         raise Exception(f"Internal server error: {e}")
 
 async def _Intents_balance(env: Environment, account_id,data_old):
-    data = (load_url("https://api-mng-console.chaindefuser.com/api/tokens"))
-    if data["items"] is None:
-        data = data_old
-    else:
-        data = data["items"]
+    data, _ = await asyncio.to_thread(price_service.snapshot)
     user_account_id = env.env_vars.get("ACCOUNT_ID")
     user_private_key = env.env_vars.get("PRIVATE_KEY")
     token_ids = [item["defuse_asset_id"] for item in data]
     
-    args = {
-        "account_id": account_id,
-        "token_ids": token_ids,
-    }
-    
     near = env.set_near(user_account_id,user_private_key)
     try:
-        tr = await near.view("intents.near","mt_batch_balance_of",args)
-        balance = {}
+        result = await mt_batch_balance_of(near, account_id, token_ids)
+        portfolio = price_service.portfolio(zip(token_ids, result))
+
         balances = []
-                
-        for i in range(len(token_ids)):
-            if Decimal(tr.result[i]) > 0:
-                token = [item for item in data if item.get('defuse_asset_id') == token_ids[i]]
-                
-                if token[0]["symbol"].upper() == "WNEAR":
-                    token[0]["symbol"] = "NEAR"
-                
-                
-                prev = 0
-                if token[0]["symbol"] in balance:
-                    prev = Decimal(balance[token[0]["symbol"]]["amt"])
-                    
-                current = (Decimal(tr.result[i]) / Decimal(Decimal(10) ** int(token[0]["decimals"])))
-                    
-                balance[token[0]["symbol"]] = {
-                    "amt" : str(prev + current),
-                    "usd" : str(current * (Decimal(token[0]["price"])))
-                }
-        
-        for tk in balance:
+        for holding in portfolio["holdings"]:
             
-            balances.append({"TOKEN":tk,
-                            "AMOUNT":balance[tk]["amt"],
-                            "AMOUNT_IN_USD": balance[tk]["usd"]})
+            balances.append({"TOKEN":holding["symbol"],
+                            "AMOUNT":str(holding["amount"]),
+                            "AMOUNT_IN_USD": str(holding["usd"])})
                 
         return balances
     except Exception as e:
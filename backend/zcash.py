@@ -1,106 +1,513 @@
 from decimal import Decimal
+import asyncio
+import contextvars
 import time
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from nearai.agents.environment import Environment
 import json
 from intents.withdraw import withdraw_from_intents
+from balance_cache import balance_cache
+from journal import operation, resumer
+from poller import BatchPoller
+from progress import emit
+from scheduler import get_scheduler
+from intents.utils import mt_batch_balance_of
+from token_registry import registry, registry_for
 
 rpc_url = "https://bridge.chaindefuser.com/rpc"
 zcash_fees = Decimal("0.0002")
 zcash_account = None
 
-with open("tokens.json", "r") as file:
-    data = json.load(file)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+
+ZEC = registry.by_symbol("ZEC")[0]
+
+
+class ZcashRpcError(Exception):
+    """Error object returned by the Zcash node or bridge for a JSON-RPC call"""
+    def __init__(self, method, error):
+        self.method = method
+        self.error = error
+        message = error.get("message") if isinstance(error, dict) else error
+        super().__init__(f"{method}: {message}")
+
+
+def _call_payload(version, method, params):
+    return {"jsonrpc": version, "id": method, "method": method, "params": list(params)}
+
+def _call_result(method, response):
+    if response.get("error"):
+        raise ZcashRpcError(method, response["error"])
+    return response.get("result")
+
+def _batch_payload(version, calls):
+    return [
+        {"jsonrpc": version, "id": i, "method": call[0], "params": list(call[1:])}
+        for i, call in enumerate(calls)
+    ]
+
+def _batch_results(calls, responses):
+    if isinstance(responses, dict):  # the endpoint rejected the batch as a whole
+        raise ZcashRpcError("batch", responses.get("error"))
+
+    by_id = {response.get("id"): response for response in responses}
+    results = []
+    for i, call in enumerate(calls):
+        response = by_id.get(i)
+        if response is None:
+            results.append(ZcashRpcError(call[0], "missing response in batch"))
+        elif response.get("error"):
+            results.append(ZcashRpcError(call[0], response["error"]))
+        else:
+            results.append(response.get("result"))
+    return results
+
+
+class ZcashRpcClient:
+    """Keep-alive JSON-RPC client for a single Zcash node.
+
+    All requests share one `requests.Session`, so connections to the node are
+    pooled and reused instead of paying a new TCP/TLS handshake per call.
+    """
+    def __init__(self, node_url, username=None, password=None, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.node_url = node_url
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "text/plain"})
+        if username or password:
+            self.session.auth = HTTPBasicAuth(username, password)
+
+        self._tracker = None
+        self._tracker_lock = threading.Lock()
+
+    def post(self, payload):
+        response = self.session.post(self.node_url, json=payload, timeout=self.timeout)
+        # zcashd reports RPC errors with a 500 status and a JSON body, so only
+        # treat the status as fatal when there is no JSON-RPC body to read.
+        try:
+            return response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+
+    def call(self, method: str, *params: Any) -> Any:
+        return _call_result(method, self.post(_call_payload("1.0", method, params)))
+
+    def batch(self, *calls):
+        """Send several `(method, *params)` calls in a single HTTP request.
+
+        Returns one entry per call, in the order given: the call's result, or
+        a ZcashRpcError instance if that particular call failed.
+        """
+        return _batch_results(calls, self.post(_batch_payload("1.0", calls)))
+
+    @property
+    def tracker(self):
+        """The OperationTracker polling this node's shielded operations."""
+        with self._tracker_lock:
+            if self._tracker is None:
+                self._tracker = OperationTracker(self)
+            return self._tracker
+
+    def close(self):
+        self.session.close()
+
+
+class OperationTracker(BatchPoller):
+    """Tracks outstanding z_sendmany operations for one node.
+
+    Every registered opid is polled by a single background thread with one
+    batched `z_getoperationstatus([opid, ...])` call per tick. The tick starts
+    at `min_interval` and backs off towards `max_interval` while nothing
+    changes. Each opid resolves a Future with its final status object.
+    """
+    name = "zcash-operation-tracker"
+    FINAL_STATES = ("success", "failed", "cancelled")
+
+    def __init__(self, client, min_interval=1.0, max_interval=10.0, backoff=1.5, max_misses=3):
+        super().__init__(error_interval=max_interval)
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_misses = max_misses
+
+        self._interval = min_interval
+
+    def _new_entry(self, opid):
+        return {"misses": 0}
+
+    def _on_track(self, opid):
+        self._interval = self.min_interval
+
+    def _tick(self):
+        with self._lock:
+            opids = list(self._entries)
+
+        resolved = []
+        try:
+            statuses = self.client.call("z_getoperationstatus", opids) or []
+        except (requests.exceptions.RequestException, ZcashRpcError, ValueError) as e:
+            print(f"Operation status poll failed: {e}")
+            statuses = None
+
+        if statuses is not None:
+            seen = set()
+            for status in statuses:
+                opid = status.get("id")
+                seen.add(opid)
+                if status.get("status") in self.FINAL_STATES:
+                    resolved.append((opid, status))
+            # Operations the node no longer knows about (e.g. after a
+            # restart) are reported as "unknown" instead of polled forever.
+            with self._lock:
+                for opid in opids:
+                    entry = self._entries.get(opid)
+                    if opid in seen or entry is None:
+                        continue
+                    entry["misses"] += 1
+                    if entry["misses"] >= self.max_misses:
+                        resolved.append((opid, {"id": opid, "status": "unknown"}))
+        self._resolve(resolved)
+
+        with self._lock:
+            if resolved:
+                self._interval = self.min_interval
+            else:
+                self._interval = min(self._interval * self.backoff, self.max_interval)
+            return self._interval
+
+
+class AddressIndex:
+    """Hash index of wallet address -> wallet account, built from `listaddresses`.
+
+    Unified addresses map to their account. Transparent and Sapling addresses
+    outside any account are indexed too, mapped to None, so looking them up
+    does not count as a miss. The index is rebuilt when it is older than
+    `ttl` seconds or on a miss, and an address that is still missing after a
+    rebuild is not looked for again for `ttl` seconds. It is extended in place
+    when this module hands out new addresses. When `path` is set, the index
+    is also persisted there as JSON so a restart does not need a full rescan
+    while the snapshot is still fresh.
+    """
+    def __init__(self, client, ttl=300, path=None):
+        self.client = client
+        self.ttl = ttl
+        self.path = path
+
+        self._accounts = {}
+        self._misses = {}  # address -> when a rebuild last failed to find it
+        self._built_at = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as file:
+                snapshot = json.load(file)
+            self._accounts = snapshot["accounts"]
+            self._built_at = snapshot["built_at"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w") as file:
+                json.dump({"built_at": self._built_at, "accounts": self._accounts}, file)
+        except OSError as e:
+            print(f"Could not persist address index: {e}")
+
+    def refresh(self):
+        list_addresses = self.client.call("listaddresses")
+        if list_addresses is None:
+            raise ValueError("Invalid response: missing 'result' key")
+
+        accounts = {}
+        for wallet in list_addresses:
+            transparent = wallet.get("transparent") or {}
+            for address in transparent.get("addresses", []) + transparent.get("changeAddresses", []):
+                accounts[address] = None
+            for key in wallet.get("sapling", []):
+                for address in key.get("addresses", []):
+                    accounts[address] = None
+
+            for account_info in wallet.get("unified", []):
+                if not isinstance(account_info.get("addresses"), list):
+                    continue
+                for addr in account_info["addresses"]:
+                    if "address" in addr:
+                        accounts[addr["address"]] = account_info["account"]
+
+        with self._lock:
+            self._accounts = accounts
+            self._misses = {}
+            self._built_at = time.time()
+            self._save()
+
+    def add(self, address, account):
+        with self._lock:
+            self._misses.pop(address, None)
+            if self._accounts.get(address) == account:
+                return
+            self._accounts[address] = account
+            self._save()
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = 0
+            self._misses = {}
+
+    def lookup(self, address):
+        """The wallet account of `address`; None if it has none or is not in the wallet."""
+        refreshed = False
+        if time.time() - self._built_at > self.ttl:
+            self.refresh()
+            refreshed = True
+
+        if address in self._accounts:
+            return self._accounts[address]
+
+        if not refreshed and time.time() - self._misses.get(address, 0) > self.ttl:
+            self.refresh()
+            refreshed = True
+            if address in self._accounts:
+                return self._accounts[address]
+        if refreshed:
+            with self._lock:
+                self._misses[address] = time.time()
+        return None
+
+
+class AsyncJsonRpcClient:
+    """Asyncio counterpart of ZcashRpcClient, backed by a pooled httpx.AsyncClient.
+
+    Used for the Zcash node (JSON-RPC 1.0, basic auth) and for the
+    chaindefuser bridge (JSON-RPC 2.0). An instance is bound to the event loop
+    it was created on; use get_async_client / get_bridge_client to get the one
+    for the running loop.
+    """
+    def __init__(self, url, username=None, password=None, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 version="1.0", content_type="text/plain"):
+        self.url = url
+        self.version = version
+        self.http = httpx.AsyncClient(
+            auth=(username or "", password or "") if username or password else None,
+            headers={"Content-Type": content_type},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def post(self, payload):
+        response = await self.http.post(self.url, json=payload)
+        try:
+            return response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+
+    async def call(self, method: str, *params: Any) -> Any:
+        return _call_result(method, await self.post(_call_payload(self.version, method, params)))
+
+    async def batch(self, *calls):
+        """Async version of ZcashRpcClient.batch."""
+        return _batch_results(calls, await self.post(_batch_payload(self.version, calls)))
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def _client_config(env: Environment):
+    env_vars = env.env_vars
+    return (
+        env_vars.get("ZCASH_NODE_URL"),
+        env_vars.get("ZCASH_USER"),
+        env_vars.get("ZCASH_PASS"),
+        int(env_vars.get("ZCASH_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        float(env_vars.get("ZCASH_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+        float(env_vars.get("ZCASH_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+    )
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(env: Environment) -> ZcashRpcClient:
+    """Return the pooled RPC client for the node configured in `env`."""
+    key = _client_config(env)
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = ZcashRpcClient(*key)
+            _clients[key] = client
+        return client
+
+# httpx connections cannot be shared between event loops, so async clients are
+# kept per running loop and dropped together with it.
+_async_clients = weakref.WeakKeyDictionary()
+
+def _loop_clients():
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+    return clients
+
+def get_async_client(env: Environment) -> AsyncJsonRpcClient:
+    """Return the async RPC client for the node configured in `env` on the running loop."""
+    key = _client_config(env)
+    clients = _loop_clients()
+    if key not in clients:
+        clients[key] = AsyncJsonRpcClient(*key)
+    return clients[key]
+
+def get_bridge_client() -> AsyncJsonRpcClient:
+    """Return the async client for the chaindefuser bridge RPC on the running loop."""
+    clients = _loop_clients()
+    if rpc_url not in clients:
+        clients[rpc_url] = AsyncJsonRpcClient(rpc_url, version="2.0", content_type="application/json")
+    return clients[rpc_url]
+
+_address_indexes = {}
+
+def get_address_index(env: Environment) -> AddressIndex:
+    """Return the address index for the node configured in `env`."""
+    env_vars = env.env_vars
+    path = None
+    if env_vars.get("ZCASH_ADDRESS_INDEX_PERSIST") and env_vars.get("ZCASH_ACCOUNT_FILE"):
+        path = env_vars.get("ZCASH_ACCOUNT_FILE") + ".addresses.json"
+    key = (_client_config(env), path)
+
+    with _clients_lock:
+        index = _address_indexes.get(key)
+        if index is None:
+            ttl = float(env_vars.get("ZCASH_ADDRESS_INDEX_TTL", 300))
+            index = _address_indexes[key] = AddressIndex(get_client(env), ttl, path)
+        return index
+
+async def close_async_clients():
+    """Close the async clients of the running loop."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+async def _closing_clients(coro):
+    try:
+        return await coro
+    finally:
+        await close_async_clients()
+
+_sync_loop = None
+_sync_loop_lock = threading.Lock()
+
+def _get_sync_loop():
+    # One long-lived loop on a daemon thread runs every sync call, so its
+    # async clients (and their connection pools) are reused between calls.
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None or _sync_loop.is_closed():
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever, name="zcash-sync-loop", daemon=True).start()
+        return _sync_loop
+
+def run_sync(coro):
+    """Run `coro` to completion from synchronous code.
+
+    The coroutine runs on the shared background loop, in a copy of the
+    caller's context (so progress channels and the like carry over).
+    """
+    loop = _get_sync_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        # Called from a coroutine on the background loop itself, which must
+        # not block on its own work: use a throwaway loop on a helper thread.
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(contextvars.copy_context().run, asyncio.run, _closing_clients(coro)).result()
+
+    result = Future()
+    tasks = []
+
+    def start():
+        task = loop.create_task(coro)
+        tasks.append(task)
+
+        def done(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+        task.add_done_callback(done)
+
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    try:
+        return result.result()
+    except BaseException:
+        # e.g. KeyboardInterrupt while waiting; do not leave the work running.
+        if tasks:
+            loop.call_soon_threadsafe(tasks[0].cancel)
+        raise
 
 def createAccount(env: Environment):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_getnewaccount",
-        "params": []
-    }
-
-    node_url = env.env_vars.get("ZCASH_NODE_URL")
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-
-    if response["result"]["account"]:
-        return int(response["result"]["account"])
+    result = get_client(env).call("z_getnewaccount")
+
+    if result["account"]:
+        return int(result["account"])
     
     return -1
 
-def getAddressForAccount(env: Environment, account):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_listaccounts",
-        "params": []
-    }
-
-    node_url = env.env_vars.get("ZCASH_NODE_URL")
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-    if response["result"][int(account)]["addresses"]:
-        return response["result"][int(account)]["addresses"][0]["ua"]
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_getaddressforaccount",
-        "params": [int(account)]
-    }
-
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-
-    if response["result"]["address"]:
-        return response["result"]["address"]
+def getAddressForAccount(env: Environment, account, accounts=None):
+    client = get_client(env)
+    index = get_address_index(env)
+
+    if accounts is None:
+        accounts = client.call("z_listaccounts")
+    if accounts[int(account)]["addresses"]:
+        for addr in accounts[int(account)]["addresses"]:
+            index.add(addr["ua"], int(account))
+        return accounts[int(account)]["addresses"][0]["ua"]
+
+    result = client.call("z_getaddressforaccount", int(account))
+
+    if result["address"]:
+        index.add(result["address"], int(account))
+        return result["address"]
     else:
         env.add_reply(f"Unable to make an address for the account {account} for app usage.")
         return ""
 
 def getAccountForAddress(env: Environment, address):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "listaddresses",
-        "params": []
-    }
-
     try:
-        data = requests.post(env.env_vars.get("ZCASH_NODE_URL"), json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-        
-        if "result" not in data:
-            raise ValueError("Invalid response: missing 'result' key")
-        
-        list_addresses = data["result"]
-        
-        for wallet in list_addresses:
-            if "unified" not in wallet:
-                continue
-            for account_info in wallet["unified"]:
-                if "addresses" not in account_info or not isinstance(account_info["addresses"], list):
-                    continue
-                for addr in account_info["addresses"]:
-                    if "address" in addr and addr["address"] == address:
-                        return account_info["account"]
-        
-        return None  # Address not found
+        return get_address_index(env).lookup(address)  # None if the address is not found
     
     except requests.exceptions.RequestException as e:
         env.add_reply(f"Request error: {e}")
         return None
+    except ZcashRpcError as e:
+        env.add_reply(f"Zcash node error: {e}")
+        return None
     except ValueError as e:
         env.add_reply(f"JSON parsing error: {e}")
         return None
@@ -136,169 +543,151 @@ def getZcashIntentAccount(env: Environment):
     return zcash_account
 
 def validate_zcash_address(env: Environment, address):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_validateaddress",
-        "params": [
-            address
-        ]
-    }
-
-    node_url = env.env_vars.get("ZCASH_NODE_URL")
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-    if not response["result"]["isvalid"]:
-        return {"isvalid": response["result"]["isvalid"], "address_type": "invalid"}
-    return {"isvalid": response["result"]["isvalid"], "address_type": response["result"]["address_type"]}
+    result = get_client(env).call("z_validateaddress", address)
+    if not result["isvalid"]:
+        return {"isvalid": result["isvalid"], "address_type": "invalid"}
+    return {"isvalid": result["isvalid"], "address_type": result["address_type"]}
 
 def wallet_balance(env: Environment):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "getwalletinfo",
-        "params": []
-    }
-
-    node_url = env.env_vars.get("ZCASH_NODE_URL")
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-    return response["result"]["balance"], response["result"]["shielded_balance"]
-
-def account_balance(env: Environment, account):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    token_data = [obj for obj in data if obj["symbol"] == 'ZEC'][0]
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_getbalanceforaccount",
-        "params": [int(account)]
-    }
-
-    response = requests.post(env.env_vars.get("ZCASH_NODE_URL"), json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
+    result = get_client(env).call("getwalletinfo")
+    return result["balance"], result["shielded_balance"]
 
+def _pool_balances(result):
     balance_transparent = 0
     balance_shielded = 0
 
-    if response["result"]:
-        pools = response["result"]["pools"]
+    if result:
+        pools = result["pools"]
 
         if pools and "transparent" in pools and pools["transparent"]["valueZat"]:
-            balance_transparent = Decimal(pools["transparent"]["valueZat"]) / (Decimal(10) ** int(token_data["decimals"]))
+            balance_transparent = ZEC.from_units(pools["transparent"]["valueZat"])
 
         if pools and "sapling" in pools and pools["sapling"]["valueZat"]:
-            balance_shielded = Decimal(pools["sapling"]["valueZat"]) / (Decimal(10) ** int(token_data["decimals"]))
+            balance_shielded = ZEC.from_units(pools["sapling"]["valueZat"])
 
         if pools and "orchard" in pools and pools["orchard"]["valueZat"]:
-            balance_shielded = balance_shielded + Decimal(pools["orchard"]["valueZat"]) / (Decimal(10) ** int(token_data["decimals"]))
+            balance_shielded = balance_shielded + ZEC.from_units(pools["orchard"]["valueZat"])
 
     return balance_transparent, balance_shielded
 
+def account_balance(env: Environment, account, fresh=False):
+    key = f"zcash:{int(account)}"
+    balances = None if fresh else balance_cache.get(key, "ZEC")
+    if balances is None:
+        balances = _pool_balances(get_client(env).call("z_getbalanceforaccount", int(account)))
+        balance_cache.put(key, "ZEC", balances)
+    return balances
 
+async def account_balance_async(env: Environment, account, fresh=False):
+    key = f"zcash:{int(account)}"
+    balances = None if fresh else balance_cache.get(key, "ZEC")
+    if balances is None:
+        balances = _pool_balances(await get_async_client(env).call("z_getbalanceforaccount", int(account)))
+        balance_cache.put(key, "ZEC", balances)
+    return balances
 
-def transfer(env: Environment, sender, amount, recipient, args = [1, str(zcash_fees), 'NoPrivacy']):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-
-    headers = {"Content-Type": "text/plain"}
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_sendmany",
-        "params": [
-            sender,
-            [
-                {
-                    "address": recipient,
-                    "amount": str(Decimal(amount) - zcash_fees)
-                }
-            ],
-        ]
-    }
 
-    payload["params"].extend(args)
 
-    node_url = env.env_vars.get("ZCASH_NODE_URL")
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-    if not response["result"]:
-        return False
-    opid = response["result"]
+def transfer(env: Environment, sender, amount, recipient, args = [1, str(zcash_fees), 'NoPrivacy']):
+    """Synchronous facade over transfer_async for callers outside an event loop."""
+    return run_sync(transfer_async(env, sender, amount, recipient, args))
 
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_listoperationids",
-        "params": []
-    }
+async def transfer_async(env: Environment, sender, amount, recipient, args = [1, str(zcash_fees), 'NoPrivacy'], op=None, step=None):
+    """Send with z_sendmany and wait for the txid.
 
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-    
-    if opid not in response["result"]:
+    Transfers from the same wallet account run one at a time, so they do not
+    pick the same notes. With a journal `op`, the opid and txid are recorded
+    under `step`; a resumed operation that already sent waits on the
+    recorded opid (or returns the recorded txid) instead of sending again.
+    """
+    try:
+        account = await asyncio.to_thread(get_address_index(env).lookup, sender)
+    except Exception as e:
+        # The index only picks the lock; a node error here must not stop the transfer.
+        print(f"Could not look up the account of {sender}: {e}")
+        account = None
+    async with get_scheduler(env).hold_async(("zcash", account if account is not None else sender)):
+        return await _transfer(env, sender, amount, recipient, args, op, step)
+
+async def _transfer(env: Environment, sender, amount, recipient, args, op, step):
+    client = get_async_client(env)
+
+    if op is not None and op.get(step, "txid"):
+        return op.get(step, "txid")
+
+    opid = op.get(step, "opid") if op is not None else None
+    if not opid:
+        opid = await client.call("z_sendmany", sender, [
+            {
+                "address": recipient,
+                "amount": str(Decimal(amount) - zcash_fees)
+            }
+        ], *args)
+        if not opid:
+            return False
+        if op is not None:
+            op.record(step, opid=opid)
+        emit("opid_submitted", opid=opid, recipient=recipient, amount=str(amount))
+
+    timeout = 300
+    try:
+        result = await get_client(env).tracker.wait(opid, timeout)
+    except asyncio.TimeoutError:
+        env.add_reply("Timeout: Operation did not complete within 5 minutes")
+        return None
+    finally:
+        # Whatever the outcome, the wallet's spendable notes may have changed.
+        balance_cache.invalidate(asset="ZEC")
+
+    if result["status"] == "success":
+        if op is not None:
+            op.record(step, txid=result["result"]["txid"])
+        emit("txid", chain="zec", opid=opid, txid=result["result"]["txid"])
+        return result["result"]["txid"]
+    elif result["status"] == "unknown":
         return opid
 
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_getoperationstatus",
-        "params": [
-            [opid]
-        ]
-    }
+    emit("operation_failed", opid=opid, status=result["status"])
+    env.add_reply(result)
+    return None
 
-    start_time = time.time()
-    timeout = 300
-    
-    while True:
-        response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-        if response["result"] and response["result"][0]:  # Check if result is available
-            result = response["result"][0]
-
-            if result["status"] == "success":
-                txid = result["result"]["txid"]
-                return txid
-            elif result["status"] == "failed":
-                env.add_reply(result)
-                return None
-        
-        if time.time() - start_time > timeout:  # Check if 2 minutes have passed
-            env.add_reply("Timeout: Operation did not complete within 2 minutes")
-            return None  # Or handle timeout case accordingly
-        
-        time.sleep(2)
 
 
 
+async def deposit(env: Environment, sender, amount, op=None):
+    with operation(env, "zcash.deposit", op, sender=sender, amount=amount) as op:
+        txid = await _deposit(env, sender, amount, op)
+        if not txid:
+            op.finish("failed")
+        return txid
+
+@resumer("zcash.deposit")
+async def _resume_deposit(env: Environment, op):
+    return await deposit(env, op.params["sender"], op.params["amount"], op)
 
-async def deposit(env: Environment, sender, amount):
+async def _deposit(env: Environment, sender, amount, op):
     
     user_account_id = env.env_vars.get("ACCOUNT_ID")
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
 
-    headers = {"Content-Type": "text/plain"}
+    token_data = ZEC
 
-    account = getAccountForAddress(env, sender)
-    balance_transparent, balance_shielded = account_balance(env, account)
+    amount = Decimal(amount) + Decimal(zcash_fees)
 
-    match = [obj for obj in data if obj["symbol"] == "ZEC"]
-    token_data = match[0]
+    # Once something was sent, the balance checks below no longer apply; the
+    # journal says which transfers already went out.
+    account = None
+    shield = op.get("shield") is not None
+    if not shield and op.get("deposit") is None:
+        account = await asyncio.to_thread(getAccountForAddress, env, sender)
+        balance_transparent, balance_shielded = await account_balance_async(env, account)
 
-    amount = Decimal(amount) + Decimal(zcash_fees)
-    if Decimal(amount) > Decimal(balance_shielded) + Decimal(balance_transparent):
-        env.add_reply(f"You have insufficiant balance of {Decimal(balance_shielded) + Decimal(balance_transparent)}. Cannot deposit {amount}")
-        return False
+        if Decimal(amount) > Decimal(balance_shielded) + Decimal(balance_transparent):
+            env.add_reply(f"You have insufficiant balance of {Decimal(balance_shielded) + Decimal(balance_transparent)}. Cannot deposit {amount}")
+            return False
+
+        shield = Decimal(amount) > Decimal(balance_shielded) and Decimal(amount) < Decimal(balance_shielded) + Decimal(balance_transparent)
 
-    if Decimal(amount) > Decimal(balance_shielded) and Decimal(amount) < Decimal(balance_shielded) + Decimal(balance_transparent):
+    if shield:
         args = [
             1,
             str(zcash_fees),
@@ -306,7 +695,11 @@ async def deposit(env: Environment, sender, amount):
         ]
 
         amount = Decimal(amount) + Decimal(zcash_fees)
-        txid = transfer(env, sender, amount, sender, args)
+
+    if shield and op.get("deposit") is None:
+        if account is None:
+            account = await asyncio.to_thread(getAccountForAddress, env, sender)
+        txid = await transfer_async(env, sender, amount, sender, args, op, "shield")
         if not txid:
             return False
         
@@ -315,7 +708,7 @@ async def deposit(env: Environment, sender, amount):
         start_time = time.time()
         timeout = 300
         while True:
-            _, shielded = account_balance(account)
+            _, shielded = await account_balance_async(env, account, fresh=True)
             if Decimal(shielded) > Decimal(amount):
                 break
             
@@ -323,22 +716,15 @@ async def deposit(env: Environment, sender, amount):
                 env.add_reply("Timeout: Operation did not complete within 5 minutes")
                 return None
 
-            time.sleep(2)
-
-    payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "deposit_address",
-        "params": [{
-            "account_id": user_account_id,
-            "chain": "zec:mainnet"
-        }]
-    }
-    
+            await asyncio.sleep(2)
+
     # wait unitl the amount gets confirmed on intents
     
-    response = requests.post(rpc_url, json=payload).json()
-    deposit_address = response["result"]["address"]
+    response = await get_bridge_client().call("deposit_address", {
+        "account_id": user_account_id,
+        "chain": "zec:mainnet"
+    })
+    deposit_address = response["address"]
 
     args = [
         1,
@@ -346,7 +732,7 @@ async def deposit(env: Environment, sender, amount):
         "NoPrivacy"
     ]
 
-    txid = transfer(env, sender, amount, deposit_address, args)
+    txid = await transfer_async(env, sender, amount, deposit_address, args, op, "deposit")
     env.add_reply(f"Transaction Id: {txid}")
     
     start_time = time.time()
@@ -356,14 +742,9 @@ async def deposit(env: Environment, sender, amount):
     user_private_key = env.env_vars.get("PRIVATE_KEY", None)
     near = env.set_near(user_account_id, user_private_key)
     
-    args = {
-        "account_id": user_account_id,
-        "token_ids": ["nep141:zec.omft.near"],
-    }
-    
     while True:
-        tr = await near.view("intents.near", "mt_batch_balance_of", args)
-        zec_balance = Decimal(tr.result[0]) / Decimal(Decimal(10) ** int(token_data["decimals"]))
+        balance = (await mt_batch_balance_of(near, user_account_id, ["nep141:zec.omft.near"], fresh=True))[0]
+        zec_balance = token_data.from_units(balance)
         
         if Decimal(zec_balance) >= Decimal(amount) - Decimal(zcash_fees):
             break
@@ -371,22 +752,39 @@ async def deposit(env: Environment, sender, amount):
         if time.time() - start_time > timeout:  # Check if 5 minutes have passed
             return txid
         
-        time.sleep(10)
+        await asyncio.sleep(10)
         
     return txid
 
-async def withdraw(env: Environment, token, amount, recipient, data):
-    username = env.env_vars.get("ZCASH_USER")
-    password = env.env_vars.get("ZCASH_PASS")
-    headers = {"Content-Type": "text/plain"}
-    
-    obj = validate_zcash_address(env, recipient)
-    is_valid, address_type = obj["isvalid"], obj["address_type"]
+async def withdraw(env: Environment, token, amount, recipient, data, op=None):
+    with operation(env, "zcash.withdraw", op, token=token, amount=amount, recipient=recipient) as op:
+        txid = await _withdraw(env, token, amount, recipient, data, op)
+        if not txid:
+            op.finish("failed")
+        return txid
+
+@resumer("zcash.withdraw")
+async def _resume_withdraw(env: Environment, op):
+    return await withdraw(env, op.params["token"], op.params["amount"], op.params["recipient"], registry, op)
+
+async def _withdraw(env: Environment, token, amount, recipient, data, op):
+    client = get_async_client(env)
+
+    # Validate the recipient and fetch the wallet accounts in one round trip.
+    validation, accounts = await client.batch(
+        ("z_validateaddress", recipient),
+        ("z_listaccounts",),
+    )
+    if isinstance(validation, ZcashRpcError):
+        raise validation
+
+    is_valid = validation["isvalid"]
+    address_type = validation["address_type"] if is_valid else "invalid"
     if not is_valid:
         env.add_reply(f"Address {recipient} is not valid for zcash chain.")
         return False
 
-    match = [obj for obj in data if obj["symbol"] == token.upper()]
+    match = registry_for(data).by_symbol(token)
 
     if not match:
       env.add_reply(f"Token {token} may not be supported for this app.")
@@ -395,43 +793,65 @@ async def withdraw(env: Environment, token, amount, recipient, data):
     token_data = match[0]
 
     if address_type in ("p2pkh", "p2sh"):
-        return await withdraw_from_intents(env, token, amount, recipient, data)
+        return await withdraw_from_intents(env, token, amount, recipient, data, token_data, op)
     
-    account = getZcashIntentAccount(env)
+    account = await asyncio.to_thread(getZcashIntentAccount, env)
     if account == -1:
         return False
     
     
-    unified_address = getAddressForAccount(env, account)
+    unified_address = await asyncio.to_thread(getAddressForAccount, env, account, None if isinstance(accounts, ZcashRpcError) else accounts)
 
     if not unified_address:
         return False
 
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_listunifiedreceivers",
-        "params": [unified_address]
-    }
+    receivers = await client.call("z_listunifiedreceivers", unified_address)
 
-    node_url = env.env_vars.get("ZCASH_NODE_URL")
-    response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
+    transparent_address = receivers.get("p2pkh") or receivers.get("p2sh")
+    shielded_address = receivers.get("sapling") or receivers.get("orchard")
 
-    transparent_address = response["result"]["p2pkh"] or response["result"]["p2sh"]
-    shielded_address = response["result"]["sapling"] or response["result"]["orchard"]
-
-    result = await withdraw_from_intents(env, token, amount, transparent_address, data)
+    result = await withdraw_from_intents(env, token, amount, transparent_address, data, token_data, op)
     if not result:
         return False
     
-    payload = {
-        "jsonrpc": "2.0",
-        "id": "dontcare",
-        "method": "withdrawal_status",
-        "params": [{
-            "withdrawal_hash": result 
-        }]
-    }
+    if op.get("bridge", "status") is None:
+        if not await _wait_for_bridge(env, result, op):
+            return None
+
+    start_time = time.time()
+    timeout = 600
+
+    while True:
+        result = await client.call("z_getbalanceforaccount", int(account))
+        if result:
+            pools = result["pools"]
+
+            if pools and pools["transparent"] and pools["transparent"]["valueZat"]:
+                balance = token_data.from_units(pools["transparent"]["valueZat"])
+                if Decimal(amount) - zcash_fees <= balance:
+                    break
+
+        if time.time() - start_time > timeout:  # Check if 5 minutes have passed
+            env.add_reply("Timeout: Operation did not complete within 5 minutes")
+            return None
+
+        await asyncio.sleep(2)
+
+    args = [
+        1,
+        str(zcash_fees),
+        "AllowRevealedSenders"
+    ]
+
+    txid = await transfer_async(env, unified_address, amount, recipient, args, op, "send")
+    env.add_reply(f"Transaction Hash: {txid}")
+    return txid
+
+async def _wait_for_bridge(env: Environment, result, op):
+    """Poll the bridge until the withdrawal `result` leaves PENDING; False on timeout."""
+    bridge = get_bridge_client()
+    op.record("bridge", withdrawal_hash=result)
+    emit("withdrawal_submitted", withdrawal_hash=result)
     
     start_time = time.time()
     timeout = 600
@@ -440,11 +860,12 @@ async def withdraw(env: Environment, token, amount, recipient, data):
     to_break = 3
     
     while True:
-        response = requests.post(rpc_url, json=payload).json()
+        try:
+            res = await bridge.call("withdrawal_status", {"withdrawal_hash": result})
+        except ZcashRpcError:
+            res = None
         
-        if "result" in response:
-            res = response["result"]
-            
+        if res is not None:
             if "withdrawals" in res:
                 
                 withdrawals = res["withdrawals"][0]
@@ -462,47 +883,14 @@ async def withdraw(env: Environment, token, amount, recipient, data):
             if to_break < 0:
                 break
             to_break = to_break - 1
-            time.sleep(5)
+            await asyncio.sleep(5)
 
         if time.time() - start_time > timeout:  # Check if 5 minutes have passed
             env.add_reply("Timeout: Operation did not complete within 5 minutes")
             return None
     
-        time.sleep(2)
-
-
-    payload = {
-        "jsonrpc": "1.0",
-        "id": "curltest",
-        "method": "z_getbalanceforaccount",
-        "params": [int(account)]
-    }
-
-    start_time = time.time()
-    timeout = 600
-
-    while True:
-        response = requests.post(node_url, json=payload, headers=headers, auth=HTTPBasicAuth(username, password)).json()
-        if response["result"]:
-            pools = response["result"]["pools"]
+        await asyncio.sleep(2)
 
-            if pools and pools["transparent"] and pools["transparent"]["valueZat"]:
-                balance = Decimal(pools["transparent"]["valueZat"]) / (Decimal(10) ** int(token_data["decimals"]))
-                if Decimal(amount) - zcash_fees <= balance:
-                    break
-
-        if time.time() - start_time > timeout:  # Check if 5 minutes have passed
-            env.add_reply("Timeout: Operation did not complete within 5 minutes")
-            return None
-
-        time.sleep(2)
-
-    args = [
-        1,
-        str(zcash_fees),
-        "AllowRevealedSenders"
-    ]
-
-    txid = transfer(env, unified_address, amount, recipient, args)
-    env.add_reply(f"Transaction Hash: {txid}")
-    return txid
\ No newline at end of file
+    op.record("bridge", withdrawal_hash=result, transfer_tx_hash=hash, status=status if res is not None else None)
+    emit("bridge_transfer", withdrawal_hash=result, transfer_tx_hash=hash)
+    return True
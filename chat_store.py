@@ -0,0 +1,228 @@
+"""
+Chat session storage for the web server
+Each browser session has its own bounded history; idle sessions are evicted
+"""
+
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Message ids start at 1; the greeting every session starts with is id 0.
+GREETING = {
+    "id": 0,
+    "role": "assistant",
+    "content": "👋 Hello! I'm ShadowSpend, your privacy-first Zcash assistant. What would you like to do today?\n\nExamples:\n- Send 0.2 ZEC privately\n- Swap 1 ZEC to NEAR\n- Donate 0.1 ZEC to privacy nonprofits\n- Check my wallet balance"
+}
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def select_page(messages, since=None, before=None, limit=None):
+    """Pick a page of `messages` (ascending ids) for the history API.
+
+    `since` returns the messages after that id, oldest first, at most
+    `limit` of them. Otherwise the newest `limit` messages before `before`
+    (or overall) are returned. Returns `(page, has_more)`.
+    """
+    if since is not None:
+        messages = [m for m in messages if m["id"] > since]
+        if limit is not None and len(messages) > limit:
+            return messages[:limit], True
+        return messages, False
+
+    if before is not None:
+        messages = [m for m in messages if m["id"] < before]
+    if limit is not None and len(messages) > limit:
+        return messages[-limit:], True
+    return messages, False
+
+
+class MemorySessionStore:
+    """Per-process session store.
+
+    Each session keeps its last `max_messages` messages in a ring buffer;
+    message ids come from one counter per store, so they never repeat.
+    Sessions are kept in LRU order; the least recently used ones beyond
+    `max_sessions`, and any idle for longer than `idle_ttl` seconds, are
+    dropped. Only suitable for a single worker process.
+    """
+    def __init__(self, max_messages=100, max_sessions=1000, idle_ttl=3600):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+
+        self._sessions = OrderedDict()  # session_id -> (deque of messages, last seen)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Called with the lock held; the OrderedDict is oldest first.
+        while self._sessions:
+            session_id, (_, last_seen) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_seen <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+
+    def _touch(self, session_id, now):
+        messages = self._sessions.pop(session_id, (deque(maxlen=self.max_messages), now))[0]
+        self._sessions[session_id] = (messages, now)
+        return messages
+
+    def history(self, session_id, since=None, before=None, limit=None):
+        """A page of the session's messages, oldest first; see select_page.
+
+        The greeting (id 0) comes first. Returns `(page, has_more, last_id)`,
+        where `last_id` is the session's newest message id as of this read.
+        """
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            messages = list(self._touch(session_id, now)) if session_id in self._sessions else []
+        last_id = messages[-1]["id"] if messages else 0
+        return (*select_page([GREETING] + messages, since, before, limit), last_id)
+
+    def last_id(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry[0][-1]["id"] if entry and entry[0] else 0
+
+    def append(self, session_id, *messages):
+        """Store `messages` and return them with their new ids."""
+        now = time.time()
+        with self._lock:
+            stored = [{"id": next(self._ids), **message} for message in messages]
+            self._touch(session_id, now).extend(stored)
+            self._evict(now)
+        return stored
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SqliteSessionStore:
+    """Session store in a local SQLite file, shared by every worker process.
+
+    Same limits as MemorySessionStore: each session keeps its last
+    `max_messages` messages, and sessions beyond `max_sessions` (least
+    recently used first) or idle for longer than `idle_ttl` are deleted.
+    An append trims only its own session; other sessions are evicted by
+    appends at most once per `evict_interval` seconds per process.
+    """
+    def __init__(self, path, max_messages=100, max_sessions=1000, idle_ttl=3600, evict_interval=60):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.evict_interval = evict_interval
+
+        self._evicted_at = 0
+
+        self._local = threading.local()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions(last_seen);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, id);
+        """)
+
+    def _db(self):
+        # One connection per thread; SQLite serializes writers across processes.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        return db
+
+    def _evict(self, db, now):
+        # Both lookups go through the last_seen index, and each evicted
+        # session's messages through the (session_id, id) index.
+        stale = [row[0] for row in db.execute(
+            "SELECT id FROM sessions WHERE last_seen < ? OR id IN "
+            "(SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (now - self.idle_ttl, self.max_sessions))]
+        for session_id in stale:
+            db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def history(self, session_id, since=None, before=None, limit=None):
+        """A page of the session's messages, oldest first; see select_page.
+
+        The greeting (id 0) comes first. Returns `(page, has_more, last_id)`,
+        where `last_id` is the session's newest message id as of this read.
+        """
+        db = self._db()
+        db.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (time.time(), session_id))
+        # History is bounded by max_messages, so paging in Python stays cheap.
+        rows = db.execute("SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,))
+        messages = [{"id": id, "role": role, "content": content} for id, role, content in rows]
+        last_id = messages[-1]["id"] if messages else 0
+        return (*select_page([GREETING] + messages, since, before, limit), last_id)
+
+    def last_id(self, session_id):
+        row = self._db().execute("SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] or 0
+
+    def append(self, session_id, *messages):
+        """Store `messages` and return them with their new ids."""
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT INTO sessions (id, last_seen) VALUES (?, ?) "
+                       "ON CONFLICT(id) DO UPDATE SET last_seen = excluded.last_seen", (session_id, now))
+            stored = []
+            for m in messages:
+                cursor = db.execute("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                                    (session_id, m["role"], m["content"]))
+                stored.append({"id": cursor.lastrowid, **m})
+            # Everything up to the newest message beyond the limit
+            db.execute("DELETE FROM messages WHERE session_id = ? AND id <= "
+                       "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                       (session_id, session_id, self.max_messages))
+            if now - self._evicted_at >= self.evict_interval:
+                self._evicted_at = now
+                self._evict(db, now)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return stored
+
+    def clear(self, session_id):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+
+def create_store():
+    """Build the session store configured by the CHAT_* environment variables"""
+    limits = {
+        "max_messages": int(os.environ.get("CHAT_HISTORY_LIMIT", 100)),
+        "max_sessions": int(os.environ.get("CHAT_MAX_SESSIONS", 1000)),
+        "idle_ttl": float(os.environ.get("CHAT_SESSION_TTL", 3600)),
+    }
+    if os.environ.get("CHAT_STORE", "memory") == "sqlite":
+        return SqliteSessionStore(os.environ.get("CHAT_STORE_PATH", "chat_sessions.db"), **limits)
+    return MemorySessionStore(**limits)
@@ -3,35 +3,104 @@ ShadowSpend Web Server
 Serves the frontend UI and connects to the AI agent backend
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
+import inspect
 import json
 import os
+import re
 import sys
+import threading
+import time
 from pathlib import Path
 
+from chat_store import create_store, new_session_id
+
+sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+from jobs import FINISHED, FAILED, JobQueue, MemoryJobStore, SqliteJobStore
+from progress import ProgressChannel, channel as progress_channel
+
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
 CORS(app)
 
 # Try to import the agent
 try:
-    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
-    from agent import env, console
+    from agent import env, deposit_job, swap_in_intents_job, swap, withdraw_job
+    import journal
+    import zcash
+    # Wallet operations that can run as background jobs, by job kind
+    JOB_KINDS = {
+        'deposit': deposit_job,
+        'swap_in_intents': swap_in_intents_job,
+        'swap': swap,
+        'withdraw': withdraw_job
+    }
 except Exception as e:
     print(f"Warning: Could not load agent: {e}")
     env = None
+    JOB_KINDS = {}
+
+chat_store = create_store()
+
+job_queue = JobQueue(
+    SqliteJobStore(os.environ.get('JOB_STORE_PATH', 'jobs.db')) if os.environ.get('JOB_STORE') == 'sqlite' else MemoryJobStore(),
+    max_workers=int(os.environ.get('JOB_WORKERS', 4)),
+    per_account=int(os.environ.get('JOB_ACCOUNT_CONCURRENCY', 1)),
+    ttl=float(os.environ.get('JOB_TTL', 86400)),
+    lease=float(os.environ.get('JOB_LEASE', 30))
+)
+
+# How often a chat stream checks the job it relays for new progress events
+JOB_RELAY_INTERVAL = 0.5
 
-class ChatSession:
-    """Manage chat session and messages"""
-    def __init__(self):
-        self.messages = [
-            {
-                "role": "assistant",
-                "content": "👋 Hello! I'm ShadowSpend, your privacy-first Zcash assistant. What would you like to do today?\n\nExamples:\n- Send 0.2 ZEC privately\n- Swap 1 ZEC to NEAR\n- Donate 0.1 ZEC to privacy nonprofits\n- Check my wallet balance"
-            }
-        ]
+def resume_operations():
+    """Resume the journaled wallet flows that a dead worker left unfinished, reporting each on its job"""
+    try:
+        zcash.run_sync(journal.resume(env, track=lambda op: job_queue.resuming(op.id)))
+    except Exception as e:
+        print(f"Resuming operations failed: {e}")
+
+# Each worker claims what it can at startup; an operation is only taken once
+if env is not None:
+    threading.Thread(target=resume_operations, name='resume-operations', daemon=True).start()
 
-chat_session = ChatSession()
+def get_session_id():
+    """Session id sent by the client, or a new one if it sent none"""
+    return request.headers.get('X-Session-Id') or request.args.get('session_id') or new_session_id()
+
+def get_int_arg(name, args=None):
+    """Optional non-negative integer query/body parameter"""
+    value = (args if args is not None else request.args).get(name)
+    if value is None or value == '':
+        return None
+    value = int(value)
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return value
+
+def check_job(kind, params):
+    """Error message and status code if `params` cannot run a `kind` job, else None"""
+    if not JOB_KINDS:
+        return {'error': 'Agent not loaded'}, 503
+    if kind not in JOB_KINDS:
+        return {'error': f'Unknown job kind: {kind}', 'kinds': list(JOB_KINDS)}, 400
+    if not isinstance(params, dict):
+        return {'error': 'params must be an object'}, 400
+    try:
+        inspect.signature(JOB_KINDS[kind]).bind(**params)
+    except TypeError as e:
+        return {'error': f'Invalid params for {kind}: {e}'}, 400
+    return None
+
+def job_summary(job):
+    """Chat text for a finished job"""
+    if job is None:
+        return 'The operation finished, but its record has expired.'
+    if job['status'] == FAILED:
+        return f"❌ {job['kind']} failed: {job['error']}"
+    if isinstance(job['result'], str):
+        return job['result']
+    return f"✅ {job['kind']} finished."
 
 @app.route('/')
 def index():
@@ -44,29 +113,39 @@ def chat():
     try:
         data = request.json
         user_message = data.get('message', '').strip()
+        session_id = get_session_id()
+        try:
+            since = get_int_arg('since', data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         if not user_message:
             return jsonify({'error': 'Empty message'}), 400
         
-        # Add user message to history
-        chat_session.messages.append({
-            "role": "user",
-            "content": user_message
-        })
-        
         # Get bot response
         bot_response = get_bot_response(user_message)
         
-        # Add bot response to history
-        chat_session.messages.append({
-            "role": "assistant",
-            "content": bot_response
-        })
+        # Add both messages to the session history
+        new_messages = chat_store.append(
+            session_id,
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": bot_response}
+        )
+        
+        # With `since`, also return whatever else the client has not seen yet
+        # (e.g. messages sent from another tab)
+        # `last_id` is the newest message returned, so a later `since` does
+        # not skip anything added in between
+        last_id = new_messages[-1]['id']
+        if since is not None:
+            new_messages, _, last_id = chat_store.history(session_id, since=since)
         
         return jsonify({
             'success': True,
+            'session_id': session_id,
             'response': bot_response,
-            'messages': chat_session.messages
+            'messages': new_messages,
+            'last_id': last_id
         })
     
     except Exception as e:
@@ -75,17 +154,167 @@ def chat():
             'error': str(e)
         }), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Stream a chat response as Server-Sent Events
+    `token` events carry response text as it is produced, `progress` events
+    report long-running tool steps (opid submitted, intent published/settled,
+    txid), and a final `done` (or `error`) event carries the stored messages
+    With `"job": {"kind": ..., "params": {...}}` the wallet operation is also
+    started as a background job, and its progress is relayed until it ends
+    """
+    data = request.json or {}
+    user_message = data.get('message', '').strip()
+    session_id = get_session_id()
+    job = data.get('job')
+
+    if not user_message:
+        return jsonify({'error': 'Empty message'}), 400
+    if job is not None:
+        if not isinstance(job, dict):
+            return jsonify({'error': 'job must be an object'}), 400
+        error = check_job(job.get('kind'), job.get('params') or {})
+        if error:
+            return jsonify(error[0]), error[1]
+
+    progress = ProgressChannel()
+
+    def relay_job(chunks):
+        submitted = job_queue.submit(job['kind'], JOB_KINDS[job['kind']], account=env.env_vars.get('ACCOUNT_ID'),
+                                     params=job.get('params') or {})
+        progress.put({'event': 'job_submitted', 'job_id': submitted['id'], 'kind': submitted['kind']})
+
+        # The job runs on the queue's threads, possibly after others of the
+        # same account, so its events are read back from its record
+        seen = 0
+        while True:
+            record = job_queue.get(submitted['id'])
+            events = record['events'] if record else []
+            for event in events[seen:]:
+                progress.put(dict(event))
+            seen = len(events)
+            if record is None or record['status'] in FINISHED:
+                break
+            time.sleep(JOB_RELAY_INTERVAL)
+
+        chunk = '\n\n' + job_summary(record)
+        chunks.append(chunk)
+        progress.put({'event': 'token', 'text': chunk})
+
+    def produce():
+        # Tools called while producing the response report to this request's channel
+        with progress_channel(progress):
+            try:
+                chunks = []
+                for chunk in iter_bot_response(user_message):
+                    chunks.append(chunk)
+                    progress.put({'event': 'token', 'text': chunk})
+                if job is not None:
+                    relay_job(chunks)
+                new_messages = chat_store.append(
+                    session_id,
+                    {"role": "user", "content": user_message},
+                    {"role": "assistant", "content": ''.join(chunks)}
+                )
+                progress.put({'event': 'done', 'session_id': session_id, 'messages': new_messages,
+                              'last_id': new_messages[-1]['id']})
+            except Exception as e:
+                progress.put({'event': 'error', 'error': str(e)})
+
+    # The response is produced on its own thread, so the stream can keep the
+    # connection alive while a tool runs for minutes
+    threading.Thread(target=produce, name='chat-stream', daemon=True).start()
+
+    def stream():
+        while True:
+            event = progress.get(timeout=15)
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            name = event.pop('event')
+            if name not in ('token', 'done', 'error'):
+                event = {'type': name, **event}
+                name = 'progress'
+            yield f'event: {name}\ndata: {json.dumps(event, default=str)}\n\n'
+            if name in ('done', 'error'):
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-Session-Id': session_id
+    })
+
 @app.route('/api/chat/history', methods=['GET'])
 def get_history():
-    """Get chat history"""
-    return jsonify({'messages': chat_session.messages})
+    """
+    Get chat history
+    `?since=<id>` returns only newer messages; `?before=<id>&limit=<n>` pages
+    backwards, with `next_cursor` as the `before` of the next older page
+    """
+    session_id = get_session_id()
+    try:
+        since, before, limit = get_int_arg('since'), get_int_arg('before'), get_int_arg('limit')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The history only changes when a message is added (new last id) or the
+    # session is cleared/evicted (last id drops to 0)
+    etag = f'{session_id}-{chat_store.last_id(session_id)}-{since}-{before}-{limit}'
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"', 'X-Session-Id': session_id}
+
+    # A message may have been added since the check above, so the body and
+    # its ETag use the last id read together with the page
+    messages, has_more, last_id = chat_store.history(session_id, since, before, limit)
+    etag = f'{session_id}-{last_id}-{since}-{before}-{limit}'
+    body = {
+        'session_id': session_id,
+        'messages': messages,
+        'last_id': last_id
+    }
+    if since is not None:
+        body['has_more'] = has_more
+    elif has_more:
+        body['next_cursor'] = messages[0]['id']
+
+    response = jsonify(body)
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/chat/clear', methods=['POST'])
 def clear_chat():
     """Clear chat history"""
-    chat_session.messages = [chat_session.messages[0]]  # Keep initial message
+    chat_store.clear(get_session_id())  # The greeting is always kept
     return jsonify({'success': True})
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Start a wallet operation in the background
+    Body: {"kind": "deposit" | "swap_in_intents" | "swap" | "withdraw", "params": {...}}
+    with the params of the matching agent tool; returns the job id at once
+    """
+    data = request.json or {}
+    kind = data.get('kind')
+    params = data.get('params') or {}
+
+    error = check_job(kind, params)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    job = job_queue.submit(kind, JOB_KINDS[kind], account=env.env_vars.get('ACCOUNT_ID'), params=params)
+    return jsonify({'job_id': job['id'], 'status': job['status'], 'url': f"/api/jobs/{job['id']}"}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status, progress events and result of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
 @app.route('/api/status', methods=['GET'])
 def status():
     """Get API status"""
@@ -129,6 +358,15 @@ All transactions are fully private and secure!''',
     
     return '✨ I understand. Let me process your request securely in the Trusted Execution Environment. For now, this is a demo response. ' + user_message[:50] + '...'
 
+def iter_bot_response(user_message: str):
+    """
+    Yield the bot response in chunks as it is produced
+    The demo responder answers in one piece, so it is streamed word by word
+    """
+    for chunk in re.split(r'(?<=\s)', get_bot_response(user_message)):
+        if chunk:
+            yield chunk
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     print(f"""